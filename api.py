@@ -1,14 +1,82 @@
 import os
-from flask import Flask, request, jsonify, abort
-from sqlalchemy import exc
+from flask import Blueprint, Flask, current_app, request, abort, Response
+from flask import stream_with_context
+from sqlalchemy import exc, func
+from sqlalchemy.orm import selectinload
 import json
+from dateutil.parser import isoparse
 from flask_cors import CORS
-from models import db_drop_and_create_all, setup_db, Actor, Movie
-from auth import AuthError, requires_auth
+from models import db, db_drop_and_create_all, setup_db, env_flag
+from models import Actor, Movie
+from models import bulk_insert, bulk_update, bulk_delete, existing_ids
+from models import update_row, delete_row, row_exists, not_deleted
+from models import movie_cast, add_cast, remove_cast, pool_status
+from auth import AuthError, requires_auth, permission_table
+from auth import token_cache
+import auth
+import cache
+from cache import cached_response, conditional_response
+from encoder import dumps, init_json, jsonify
+from metrics import init_metrics
+from profiler import DB_PROFILE
+from search import search
+
+blueprint = Blueprint("api", __name__)
 
-app = Flask(__name__)
-setup_db(app)
-CORS(app)
+'''
+create_app(config)
+    build the application, config (a dict) is applied to app.config first:
+    - SQLALCHEMY_DATABASE_URI: the database, DATABASE_URL by default
+    - CREATE_TABLES: create the missing tables when the first request comes
+      in (CREATE_TABLES environment variable, true by default), set it to
+      false when the schema is managed with manage.py db upgrade
+    - DB_PROFILE: profile the statements of each request, see profiler.py
+
+    building the app opens no database connection, so a worker starts
+    without waiting on the database, and an app built by the gunicorn
+    master before it forks (preload_app) shares no connection with the
+    workers
+'''
+
+
+def create_app(config=None):
+    app = Flask(__name__)
+    app.config.from_mapping(config or {})
+    app.config.setdefault("CREATE_TABLES", env_flag("CREATE_TABLES", "true"))
+    setup_db(app, app.config.get("SQLALCHEMY_DATABASE_URI"),
+             profile=app.config.get("DB_PROFILE", DB_PROFILE),
+             create_tables=False)
+    if app.config["CREATE_TABLES"]:
+        app.before_first_request(db.create_all)
+    init_json(app)
+    init_metrics(app, {
+        "casting_token_cache": (token_cache.stats, "verified token cache"),
+        "casting_response_cache": (lambda: cache.stats,
+                                   "list response cache"),
+        "casting_jwks": (lambda: {"fetches": auth.key_provider.fetches},
+                         "JWKS fetches"),
+        "casting_db_pool": (pool_status, "database connection pool"),
+    })
+    CORS(app, expose_headers=["ETag", "Server-Timing"])
+    app.register_blueprint(blueprint)
+    return app
+
+
+_app = None
+
+
+def __getattr__(name):
+    '''
+    api.app, built from the environment by create_app() when it is first
+    used (gunicorn api:app, manage.py), not when api is imported
+    '''
+    global _app
+    if name != "app":
+        raise AttributeError(
+            "module {!r} has no attribute {!r}".format(__name__, name))
+    if _app is None:
+        _app = create_app()
+    return _app
 
 '''
 !! NOTE uncomment the following line to initialize the datbase
@@ -17,26 +85,409 @@ CORS(app)
 '''
 # db_drop_and_create_all()
 
+ITEMS_PER_PAGE = 100
+MAX_ITEMS_PER_PAGE = 1000
+BULK_MAX_ITEMS = int(os.environ.get('BULK_MAX_ITEMS', 50000))
+EXPORT_BATCH_SIZE = 1000
+
+
+def paginate(query, column):
+    '''
+    keyset pagination on an increasing column (the primary key)
+
+    reads `limit` and `cursor` from the query string, 422 when malformed,
+    returns the rows after the cursor and the cursor of the next page, None
+    on the last page
+    '''
+    limit = int_arg("limit")
+    if limit is None:
+        limit = ITEMS_PER_PAGE
+    cursor = int_arg("cursor")
+    if limit < 1 or limit > MAX_ITEMS_PER_PAGE:
+        abort(422)
+
+    if cursor is not None:
+        query = query.filter(column > cursor)
+    # one extra row tells whether there is a next page
+    rows = query.order_by(column).limit(limit + 1).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = rows[-1].id
+    return rows, next_cursor
+
+
+def query_flag(name):
+    '''
+    read an opt-in boolean from the query string, i.e. ?include_total=true
+    '''
+    return request.args.get(name, "").lower() in ("1", "true")
+
+
+def int_arg(name):
+    '''
+    read an optional integer from the query string, 422 if it is malformed
+    '''
+    value = request.args.get(name)
+    if value is None:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        abort(422)
+
+
+def date_arg(name):
+    '''
+    read an optional ISO 8601 date from the query string, 422 if malformed
+    '''
+    value = request.args.get(name)
+    if value is None:
+        return None
+    try:
+        return isoparse(value)
+    except ValueError:
+        abort(422)
+
+
+'''
+filter_actors(query), filter_movies(query)
+    narrow a listing with the filters of the query string, each of them
+    backed by an index of the table
+    actors: ?name_prefix=, ?gender=, ?age_min=, ?age_max=
+    movies: ?title_prefix=, ?released_after=, ?released_before=
+'''
+
+
+def filter_actors(query):
+    name_prefix = request.args.get("name_prefix")
+    gender = request.args.get("gender")
+    age_min = int_arg("age_min")
+    age_max = int_arg("age_max")
+
+    if name_prefix:
+        query = query.filter(Actor.name.startswith(
+            name_prefix, autoescape=True))
+    if gender:
+        query = query.filter(Actor.gender == gender)
+    if age_min is not None:
+        query = query.filter(Actor.age >= age_min)
+    if age_max is not None:
+        query = query.filter(Actor.age <= age_max)
+    return query
+
+
+def filter_movies(query):
+    title_prefix = request.args.get("title_prefix")
+    released_after = date_arg("released_after")
+    released_before = date_arg("released_before")
+
+    if title_prefix:
+        query = query.filter(Movie.title.startswith(
+            title_prefix, autoescape=True))
+    if released_after is not None:
+        query = query.filter(Movie.release >= released_after)
+    if released_before is not None:
+        query = query.filter(Movie.release < released_before)
+    return query
+
+
+def release_date(value):
+    '''
+    parse the ISO 8601 release date of a request body, 422 if malformed
+    '''
+    if value is None:
+        return None
+    try:
+        return isoparse(value)
+    except (TypeError, ValueError):
+        abort(422)
+
+
+def if_match_versions():
+    '''
+    the versions listed in If-Match, None when any version is accepted
+    (no header or *), 412 when none of the tags is a version
+    '''
+    if not request.if_match or request.if_match.star_tag:
+        return None
+    versions = [int(tag) for tag in request.if_match.as_set()
+                if tag.isdigit()]
+    if not versions:
+        abort(412)
+    return versions
+
+
+def patch_row(model, id, values):
+    '''
+    update the provided columns of one row, then return it formatted
+    422 when no column is provided, 404 when the row does not exist, 412
+    when it changed since the version sent in If-Match
+    '''
+    if not values:
+        abort(422)
+    versions = if_match_versions()
+    row = update_row(model, id, values, versions)
+    if row is None:
+        if versions is not None and row_exists(model, id):
+            abort(412)
+        abort(404)
+    return row
+
+
+def embed(relation):
+    '''
+    whether the listing embeds relation (?embed=actors on movies,
+    ?embed=movies on actors), 422 for any other value
+    '''
+    value = request.args.get("embed")
+    if value is not None and value != relation:
+        abort(422)
+    return value is not None
+
+
+def export(model, key):
+    '''
+    stream every row of model, ordered by id, without holding the table in
+    memory
+
+    rows are read from a server-side cursor EXPORT_BATCH_SIZE at a time and
+    written as soon as a batch is encoded, either one json object per line
+    (?format=ndjson, the default) or as a single {"success", key} object
+    (?format=json)
+    '''
+    output = request.args.get("format", "ndjson")
+    if output not in ("ndjson", "json"):
+        abort(422)
+    rows = model.rows().order_by(model.id).execution_options(
+        stream_results=True).yield_per(EXPORT_BATCH_SIZE)
+
+    def batches():
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) == EXPORT_BATCH_SIZE:
+                yield [dumps(item) for item in model.format_rows(batch)]
+                batch = []
+        if batch:
+            yield [dumps(item) for item in model.format_rows(batch)]
+
+    def generate_ndjson():
+        for batch in batches():
+            yield b"\n".join(batch) + b"\n"
+
+    def generate_json():
+        yield ('{"success":true,"%s":[' % key).encode()
+        separator = b""
+        for batch in batches():
+            yield separator + b",".join(batch)
+            separator = b","
+        yield b"]}\n"
+
+    if output == "ndjson":
+        return Response(stream_with_context(generate_ndjson()),
+                        mimetype="application/x-ndjson")
+    return Response(stream_with_context(generate_json()),
+                    mimetype="application/json")
+
+
+'''
+actor_fields(item, partial), movie_fields(item, partial)
+    validate one item of a bulk request and return the column values to
+    write, or None when the item is unprocessable
+    with partial=True (updates) the fields are optional but at least one is
+    needed, and `id` is required
+'''
+
+
+def is_int(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def actor_fields(item, partial=False):
+    if not isinstance(item, dict):
+        return None
+    fields = {}
+    if partial:
+        if not is_int(item.get("id")):
+            return None
+        fields["id"] = item["id"]
+
+    if "name" in item or not partial:
+        if not isinstance(item.get("name"), str) or not item["name"]:
+            return None
+        fields["name"] = item["name"]
+    if "age" in item:
+        if item["age"] is not None and not is_int(item["age"]):
+            return None
+        fields["age"] = item["age"]
+    if "gender" in item:
+        if item["gender"] is not None and not isinstance(item["gender"], str):
+            return None
+        fields["gender"] = item["gender"]
+    if partial and len(fields) == 1:
+        return None
+    return fields
+
+
+def movie_fields(item, partial=False):
+    if not isinstance(item, dict):
+        return None
+    fields = {}
+    if partial:
+        if not is_int(item.get("id")):
+            return None
+        fields["id"] = item["id"]
+
+    if "title" in item or not partial:
+        if not isinstance(item.get("title"), str) or not item["title"]:
+            return None
+        fields["title"] = item["title"]
+    if "release" in item or not partial:
+        try:
+            fields["release"] = isoparse(item.get("release"))
+        except (TypeError, ValueError):
+            return None
+    if partial and len(fields) == 1:
+        return None
+    return fields
+
+
+def patch_fields(validate, id):
+    '''
+    the column values of a single PATCH body, validated like an item of a
+    bulk update, 422 when it is malformed or has no field to write
+    '''
+    body = request.get_json()
+    if not isinstance(body, dict):
+        abort(422)
+    fields = validate(dict(body, id=id), partial=True)
+    if fields is None:
+        abort(422)
+    del fields["id"]
+    return fields
+
+
+def bulk_items():
+    '''
+    the body of a bulk request, a json array of at most BULK_MAX_ITEMS items
+    '''
+    items = request.get_json()
+    if not isinstance(items, list) or len(items) > BULK_MAX_ITEMS:
+        abort(422)
+    return items
+
+
+def unprocessable_item(index):
+    return {"index": index, "status": 422, "message": "unprocessable"}
+
+
+def bulk_create(model, validate):
+    '''
+    insert the valid items in one transaction, report the result of each
+    '''
+    results = []
+    rows = []
+    for index, item in enumerate(bulk_items()):
+        fields = validate(item)
+        if fields is None:
+            results.append(unprocessable_item(index))
+        else:
+            results.append({"index": index, "status": 201})
+            rows.append(fields)
+
+    ids = iter(bulk_insert(model, rows))
+    for result in results:
+        if result["status"] == 201:
+            result["id"] = next(ids)
+    return jsonify({"success": True, "created": len(rows),
+                    "results": results})
+
+
+def bulk_modify(model, validate):
+    '''
+    update the valid items in one transaction, report the result of each
+    '''
+    results = []
+    rows = []
+    for index, item in enumerate(bulk_items()):
+        fields = validate(item, partial=True)
+        if fields is None:
+            results.append(unprocessable_item(index))
+        else:
+            results.append({"index": index, "id": fields["id"]})
+            rows.append(fields)
+
+    found = bulk_update(model, rows)
+    for result in results:
+        if "id" in result:
+            result["status"] = 200 if result["id"] in found else 404
+    return jsonify({"success": True, "updated": len(found),
+                    "results": results})
+
+
+def bulk_remove(model):
+    '''
+    delete the listed ids in one transaction, report the result of each
+    '''
+    results = []
+    ids = []
+    for index, item in enumerate(bulk_items()):
+        if is_int(item):
+            results.append({"index": index, "id": item})
+            ids.append(item)
+        else:
+            results.append(unprocessable_item(index))
+
+    found = bulk_delete(model, ids)
+    for result in results:
+        if "id" in result:
+            result["status"] = 200 if result["id"] in found else 404
+    return jsonify({"success": True, "deleted": len(found),
+                    "results": results})
+
+
 # ROUTES
-@app.route("/actors", methods=["GET"])
+@blueprint.route("/actors", methods=["GET"])
 @requires_auth("get:actors")
+@conditional_response("actors", "movies", "movie_cast")
+@cached_response("actors", "movies", "movie_cast")
 def get_actors(payload):
     '''
     get actors
-    receive get request, return a list of actors
+    receive get request, return a page of the actors matching the filters
+    and the cursor of the next page
+    with ?embed=movies each actor lists its movies, loaded for the whole
+    page by a single extra query
     '''
-    actors = [a.format() for a in Actor.query.all()]
+    if embed("movies"):
+        query = filter_actors(
+            Actor.query.filter(not_deleted(Actor)).options(
+                selectinload(Actor.movies)))
+        rows, next_cursor = paginate(query, Actor.id)
+        actors = [dict(a.format(), movies=[m.format() for m in a.movies])
+                  for a in rows]
+    else:
+        query = filter_actors(Actor.rows())
+        rows, next_cursor = paginate(query, Actor.id)
+        actors = Actor.format_rows(rows)
     # print(actors)
-    return jsonify({"success": True, "actors": actors, "total": len(actors)})
+    result = {"success": True, "actors": actors, "next_cursor": next_cursor}
+    # counting the table is a full scan, so it is only done on request
+    if query_flag("include_total"):
+        result["total"] = query.with_entities(func.count(Actor.id)).scalar()
+    return jsonify(result)
 
 
-@app.route("/actors", methods=["POST"])
+@blueprint.route("/actors", methods=["POST"])
 @requires_auth("add:actor")
 def create_actor(payload):
     '''
     create_actor
 
-    receive post request, return the new actor id and a list of actors
+    receive post request, return the new actor
+    with ?include_list=true also return the list of all actors
     '''
     body = request.get_json()
     if not body:
@@ -53,62 +504,51 @@ def create_actor(payload):
 
     new_actor.insert()
 
-    actors = [a.format() for a in Actor.query.all()]
-    # print(actors)
-    return jsonify({"success": True, "new_actor_id": new_actor.id, "actors": actors})
+    result = {"success": True, "new_actor_id": new_actor.id,
+              "actor": new_actor.format()}
+    if query_flag("include_list"):
+        result["actors"] = Actor.format_rows(Actor.rows().order_by(Actor.id))
+    return jsonify(result)
 
 
-@app.route("/actors/<int:id>", methods=["DELETE"])
+@blueprint.route("/actors/<int:id>", methods=["DELETE"])
 @requires_auth("delete:actor")
 def delete_actor(payload, id):
     '''
     delete actor
 
-    Receive delete request, then return deleted id and list of actors
+    Receive delete request, then return deleted id
+    with ?include_list=true also return the list of all actors
     '''
-    actor = Actor.query.filter(Actor.id == id).one_or_none()
-    if not actor:
+    if not delete_row(Actor, id):
         abort(404)
-    actor.delete()
-    actors = [a.format() for a in Actor.query.all()]
-    return jsonify({"success": True, "deleted_id": id, "actors": actors})
+
+    result = {"success": True, "deleted_id": id}
+    if query_flag("include_list"):
+        result["actors"] = Actor.format_rows(Actor.rows().order_by(Actor.id))
+    return jsonify(result)
 
 
-@app.route("/actors/<int:id>", methods=["PATCH"])
+@blueprint.route("/actors/<int:id>", methods=["PATCH"])
 @requires_auth("modify:actor")
 def update_actor(payload, id):
     '''
     update actor
 
-    Receive patch request to update actor, then return list of actors
+    Receive patch request to update actor, then return the updated actor
+    with ?include_list=true also return the list of all actors
+    with If-Match: "<version>" the actor is only updated at that version
     '''
     # print(id)
-    actor = Actor.query.filter(Actor.id == id).one_or_none()
-    if not actor:
-        abort(404)
-    body = request.get_json()
-
-    if not body:
-        abort(422)
-    new_name = body.get("name", None)
-    new_age = body.get("age", None)
-    new_gender = body.get("gender", None)
-
-    if new_name is None:
-        new_name = actor.name
-    if new_age is None:
-        new_age = actor.age
-    if new_gender is None:
-        new_gender = actor.gender
+    # only the provided fields are written
+    actor = patch_row(Actor, id, patch_fields(actor_fields, id))
 
-    actor.name = new_name
-    actor.age = new_age
-    actor.gender = new_gender
-
-    actor.update()
-
-    actors = [a.format() for a in Actor.query.all()]
-    return jsonify({"success": True, "updated_id": id, "actors": actors})
+    result = {"success": True, "updated_id": id, "actor": actor}
+    if query_flag("include_list"):
+        result["actors"] = Actor.format_rows(Actor.rows().order_by(Actor.id))
+    response = jsonify(result)
+    response.set_etag(str(actor["version"]))
+    return response
 
 
 """
@@ -116,29 +556,49 @@ def update_actor(payload, id):
 """
 
 
-@app.route("/movies", methods=["GET"])
+@blueprint.route("/movies", methods=["GET"])
 @requires_auth("get:movies")
+@conditional_response("movies", "actors", "movie_cast")
+@cached_response("movies", "actors", "movie_cast")
 def get_movies(payload):
     '''
     get movies
-    receive get request, return a list of movies
+    receive get request, return a page of the movies matching the filters
+    and the cursor of the next page
+    with ?embed=actors each movie lists its cast, loaded for the whole page
+    by a single extra query
     '''
-    movies = [m.format() for m in Movie.query.all()]
-    return jsonify({"success": True, "movies": movies, "total": len(movies)})
-
-
-@app.route("/movies", methods=["POST"])
+    if embed("actors"):
+        query = filter_movies(
+            Movie.query.filter(not_deleted(Movie)).options(
+                selectinload(Movie.actors)))
+        rows, next_cursor = paginate(query, Movie.id)
+        movies = [dict(m.format(), actors=[a.format() for a in m.actors])
+                  for m in rows]
+    else:
+        query = filter_movies(Movie.rows())
+        rows, next_cursor = paginate(query, Movie.id)
+        movies = Movie.format_rows(rows)
+    result = {"success": True, "movies": movies, "next_cursor": next_cursor}
+    # counting the table is a full scan, so it is only done on request
+    if query_flag("include_total"):
+        result["total"] = query.with_entities(func.count(Movie.id)).scalar()
+    return jsonify(result)
+
+
+@blueprint.route("/movies", methods=["POST"])
 @requires_auth("add:movie")
 def create_movie(payload):
     '''
     create movie
-    recieve post request, then return the new movie id, and list of movies
+    recieve post request, then return the new movie
+    with ?include_list=true also return the list of all movies
     '''
     body = request.get_json()
     if not body:
         abort(422)
     new_title = body.get("title", None)
-    new_release = body.get("release", None)
+    new_release = release_date(body.get("release", None))
 
     if not new_title:
         abort(422)
@@ -147,61 +607,272 @@ def create_movie(payload):
 
     new_movie.insert()
 
-    movies = [m.format() for m in Movie.query.all()]
-    return jsonify({"success": True, "new_movie_id": new_movie.id, "movies": movies})
+    result = {"success": True, "new_movie_id": new_movie.id,
+              "movie": new_movie.format()}
+    if query_flag("include_list"):
+        result["movies"] = Movie.format_rows(Movie.rows().order_by(Movie.id))
+    return jsonify(result)
 
 
-@app.route("/movies/<int:id>", methods=["DELETE"])
+@blueprint.route("/movies/<int:id>", methods=["DELETE"])
 @requires_auth("delete:movie")
 def delete_movie(payload, id):
     '''
     delete movie
 
-    Receive delete request, then return deleted id and list of movies
+    Receive delete request, then return deleted id
+    with ?include_list=true also return the list of all movies
     '''
-    movie = Movie.query.filter(Movie.id == id).one_or_none()
-    if not movie:
+    if not delete_row(Movie, id):
         abort(404)
-    movie.delete()
 
-    movies = [m.format() for m in Movie.query.all()]
-    return jsonify({"success": True, "deleted_id": id, "movies": movies})
+    result = {"success": True, "deleted_id": id}
+    if query_flag("include_list"):
+        result["movies"] = Movie.format_rows(Movie.rows().order_by(Movie.id))
+    return jsonify(result)
 
 
-@app.route("/movies/<int:id>", methods=["PATCH"])
+@blueprint.route("/movies/<int:id>", methods=["PATCH"])
 @requires_auth("modify:movie")
 def update_moive(payload, id):
     '''
     update movie
 
-    Receive patch request to update movies, then return list of movies
+    Receive patch request to update movies, then return the updated movie
+    with ?include_list=true also return the list of all movies
+    with If-Match: "<version>" the movie is only updated at that version
     '''
-    movie = Movie.query.filter(Movie.id == id).one_or_none()
-    if not movie:
+    movie = patch_row(Movie, id, patch_fields(movie_fields, id))
+
+    result = {"success": True, "updated_id": id, "movie": movie}
+    if query_flag("include_list"):
+        result["movies"] = Movie.format_rows(Movie.rows().order_by(Movie.id))
+    response = jsonify(result)
+    response.set_etag(str(movie["version"]))
+    return response
+
+
+"""
+/movies/<id>/actors and /actors/<id>/movies
+"""
+
+
+@blueprint.route("/movies/<int:id>/actors", methods=["GET"])
+@requires_auth("get:actors")
+def get_movie_actors(payload, id):
+    '''
+    get movie cast
+    receive get request, return the actors cast in the movie
+    '''
+    if not row_exists(Movie, id):
         abort(404)
+    rows = Actor.rows().join(
+        movie_cast, movie_cast.c.actor_id == Actor.id
+    ).filter(movie_cast.c.movie_id == id).order_by(Actor.id)
+    return jsonify({"success": True, "movie_id": id,
+                    "actors": Actor.format_rows(rows)})
+
+
+@blueprint.route("/actors/<int:id>/movies", methods=["GET"])
+@requires_auth("get:movies")
+def get_actor_movies(payload, id):
+    '''
+    get actor movies
+    receive get request, return the movies the actor is cast in
+    '''
+    if not row_exists(Actor, id):
+        abort(404)
+    rows = Movie.rows().join(
+        movie_cast, movie_cast.c.movie_id == Movie.id
+    ).filter(movie_cast.c.actor_id == id).order_by(Movie.id)
+    return jsonify({"success": True, "actor_id": id,
+                    "movies": Movie.format_rows(rows)})
+
+
+@blueprint.route("/movies/<int:id>/actors", methods=["POST"])
+@requires_auth("modify:movie")
+def cast_actors(payload, id):
+    '''
+    cast actors
+    receive post request with the actor_ids to cast in the movie, then
+    return the ids that were not cast yet
+    '''
     body = request.get_json()
+    if not body or not isinstance(body.get("actor_ids"), list):
+        abort(422)
+    actor_ids = body["actor_ids"]
+    if not actor_ids or not all(is_int(a) for a in actor_ids):
+        abort(422)
 
-    if not body:
+    if not row_exists(Movie, id):
+        abort(404)
+    if len(existing_ids(Actor, set(actor_ids))) != len(set(actor_ids)):
+        abort(404)
+
+    new_ids = add_cast(id, actor_ids)
+    return jsonify({"success": True, "movie_id": id, "cast_ids": new_ids})
+
+
+@blueprint.route("/movies/<int:id>/actors/<int:actor_id>", methods=["DELETE"])
+@requires_auth("modify:movie")
+def uncast_actor(payload, id, actor_id):
+    '''
+    uncast actor
+    receive delete request, remove the actor from the movie cast
+    '''
+    if not remove_cast(id, actor_id):
+        abort(404)
+    return jsonify({"success": True, "movie_id": id,
+                    "removed_id": actor_id})
+
+
+"""
+/search
+"""
+
+
+@blueprint.route("/search", methods=["GET"])
+@requires_auth("get:actors", "get:movies")
+@conditional_response("actors", "movies")
+@cached_response("actors", "movies")
+def search_actors_and_movies(payload):
+    '''
+    search
+    receive get request with ?q=, return a page of the actors and movies
+    matching q, best matches first, and the offset of the next page
+    '''
+    q = request.args.get("q", "").strip()
+    limit = request.args.get("limit", ITEMS_PER_PAGE, type=int)
+    offset = request.args.get("offset", 0, type=int)
+    if not q or limit < 1 or limit > MAX_ITEMS_PER_PAGE or offset < 0:
         abort(422)
-    new_title = body.get("title", None)
-    new_release = body.get("release", None)
 
-    if new_title is None:
-        new_title = movie.title
-    if new_release is None:
-        new_release = movie.release
+    # one extra result tells whether there is a next page
+    results = search(q, offset, limit + 1)
+    next_offset = None
+    if len(results) > limit:
+        results = results[:limit]
+        next_offset = offset + limit
+    return jsonify({"success": True, "results": results,
+                    "next_offset": next_offset})
+
+
+@blueprint.route("/permissions", methods=["GET"])
+@requires_auth()
+def get_permissions(payload):
+    '''
+    get permissions
+    receive get request from any authenticated user, return the permissions
+    required by each route and the ones granted to the caller
+    '''
+    return jsonify({
+        "success": True,
+        "routes": permission_table(current_app),
+        "granted": sorted(payload.granted),
+    })
+
+
+"""
+/actors/export and /movies/export
+"""
+
+
+@blueprint.route("/actors/export", methods=["GET"])
+@requires_auth("get:actors")
+@conditional_response("actors")
+def export_actors(payload):
+    '''
+    export actors
+    receive get request, stream every actor as ndjson or json
+    '''
+    return export(Actor, "actors")
+
+
+@blueprint.route("/movies/export", methods=["GET"])
+@requires_auth("get:movies")
+@conditional_response("movies")
+def export_movies(payload):
+    '''
+    export movies
+    receive get request, stream every movie as ndjson or json
+    '''
+    return export(Movie, "movies")
+
+
+"""
+/actors/bulk and /movies/bulk
+"""
+
+
+@blueprint.route("/actors/bulk", methods=["POST"])
+@requires_auth("add:actor")
+def create_actors_bulk(payload):
+    '''
+    create actors in bulk
+    receive a json array of actors, insert the valid ones in a single
+    transaction, then return the new id or the error of each item
+    '''
+    return bulk_create(Actor, actor_fields)
+
+
+@blueprint.route("/actors/bulk", methods=["PATCH"])
+@requires_auth("modify:actor")
+def update_actors_bulk(payload):
+    '''
+    update actors in bulk
+    receive a json array of partial actors with their id, update them in a
+    single transaction, then return the status of each item
+    '''
+    return bulk_modify(Actor, actor_fields)
 
-    movie.title = new_title
-    movie.release = new_release
-    movie.update()
 
-    movies = [m.format() for m in Movie.query.all()]
-    return jsonify({"success": True, "updated_id": id, "movies": movies})
+@blueprint.route("/actors/bulk", methods=["DELETE"])
+@requires_auth("delete:actor")
+def delete_actors_bulk(payload):
+    '''
+    delete actors in bulk
+    receive a json array of actor ids, delete them in a single transaction,
+    then return the status of each item
+    '''
+    return bulk_remove(Actor)
+
+
+@blueprint.route("/movies/bulk", methods=["POST"])
+@requires_auth("add:movie")
+def create_movies_bulk(payload):
+    '''
+    create movies in bulk
+    receive a json array of movies, insert the valid ones in a single
+    transaction, then return the new id or the error of each item
+    '''
+    return bulk_create(Movie, movie_fields)
+
+
+@blueprint.route("/movies/bulk", methods=["PATCH"])
+@requires_auth("modify:movie")
+def update_movies_bulk(payload):
+    '''
+    update movies in bulk
+    receive a json array of partial movies with their id, update them in a
+    single transaction, then return the status of each item
+    '''
+    return bulk_modify(Movie, movie_fields)
+
+
+@blueprint.route("/movies/bulk", methods=["DELETE"])
+@requires_auth("delete:movie")
+def delete_movies_bulk(payload):
+    '''
+    delete movies in bulk
+    receive a json array of movie ids, delete them in a single transaction,
+    then return the status of each item
+    '''
+    return bulk_remove(Movie)
 
 
 # Error Handling
 
-@app.errorhandler(422)
+@blueprint.app_errorhandler(422)
 def unprocessable(error):
     '''
     error handling for unprocessable entity
@@ -213,7 +884,19 @@ def unprocessable(error):
     }), 422
 
 
-@app.errorhandler(404)
+@blueprint.app_errorhandler(412)
+def precondition_failed(error):
+    '''
+    error for an update sent with an outdated version in If-Match
+    '''
+    return jsonify({
+        "success": False,
+        "error": 412,
+        "message": "Precondition failed"
+    }), 412
+
+
+@blueprint.app_errorhandler(404)
 def not_found(error):
     '''
     error handler for 404
@@ -225,7 +908,7 @@ def not_found(error):
     }), 404
 
 
-@app.errorhandler(400)
+@blueprint.app_errorhandler(400)
 def bad_request(error):
     '''
     error for bad request
@@ -237,7 +920,7 @@ def bad_request(error):
     }), 400
 
 
-@app.errorhandler(405)
+@blueprint.app_errorhandler(405)
 def method_not_allowed(error):
     '''
     error for unallowed method
@@ -249,7 +932,7 @@ def method_not_allowed(error):
     }), 405
 
 
-@app.errorhandler(AuthError)
+@blueprint.app_errorhandler(AuthError)
 def not_auth(AuthError):
     '''
     error handler for AuthError
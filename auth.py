@@ -1,8 +1,16 @@
+import hashlib
 import json
+import logging
 import os
+import re
+import threading
+import time
 from flask import request, _request_ctx_stack
+from collections import OrderedDict
 from functools import wraps
-from jose import jwt
+from jose import jwk, jwt
+from jose.exceptions import JWKError
+from metrics import timed
 from urllib.request import urlopen
 
 
@@ -10,6 +18,26 @@ AUTH0_DOMAIN = os.environ['AUTH0_DOMAIN']  # 'data2free.auth0.com'
 ALGORITHMS = [os.environ['ALGORITHMS']]  # ['RS256']
 API_AUDIENCE = os.environ['API_AUDIENCE']  # 'casting'
 
+# where the signing keys are published, override to serve them locally
+JWKS_URL = os.environ.get(
+    'JWKS_URL', f'https://{AUTH0_DOMAIN}/.well-known/jwks.json')
+# a JWKS document on disk, read once instead of fetching JWKS_URL
+JWKS_FILE = os.environ.get('JWKS_FILE')
+# a PEM public key verifying every token, whatever its kid
+JWT_PUBLIC_KEY = os.environ.get('JWT_PUBLIC_KEY')
+# seconds the keys stay fresh when Auth0 sends no Cache-Control max-age
+JWKS_TTL = int(os.environ.get('JWKS_TTL', 600))
+# seconds expired keys keep being served while a refresh runs
+JWKS_STALE_TTL = int(os.environ.get('JWKS_STALE_TTL', 3600))
+# minimum seconds between two fetches, bounds refetches on unknown kids
+JWKS_MIN_REFRESH_INTERVAL = int(
+    os.environ.get('JWKS_MIN_REFRESH_INTERVAL', 30))
+JWKS_FETCH_TIMEOUT = float(os.environ.get('JWKS_FETCH_TIMEOUT', 5))
+# number of verified tokens kept per worker, 0 disables the cache
+TOKEN_CACHE_SIZE = int(os.environ.get('TOKEN_CACHE_SIZE', 1024))
+
+logger = logging.getLogger(__name__)
+
 # AuthError Exception
 '''
 AuthError Exception
@@ -61,27 +89,69 @@ def get_token_auth_header():
     return token
 
 
+'''
+Payload
+    the decoded claims of a verified token, a dict whose permissions are
+    compiled once into the frozenset granted (None without a permissions
+    claim). It is what token_cache keeps, so a cached token is checked
+    without rebuilding its permissions.
+'''
+
+
+class Payload(dict):
+    def __init__(self, claims):
+        super().__init__(claims)
+        permissions = claims.get('permissions')
+        self.granted = frozenset(permissions) \
+            if isinstance(permissions, list) else None
+
+
+'''
+Requirement(all_of, any_of)
+    the permissions a route requires: every permission of all_of and, when
+    any_of is not empty, at least one of any_of. Both are frozensets built
+    once, so a check costs one lookup per required permission.
+'''
+
+
+class Requirement:
+    def __init__(self, all_of=(), any_of=()):
+        self.all_of = frozenset(all_of)
+        self.any_of = frozenset(any_of)
+
+    def satisfied_by(self, granted):
+        return self.all_of <= granted and \
+            (not self.any_of or not self.any_of.isdisjoint(granted))
+
+
 '''
     @INPUTS
-        permission: string permission (i.e. 'post:drink')
-        payload: decoded jwt payload
+        permission: string permission (i.e. 'post:drink'), or a Requirement
+        payload: decoded jwt payload, a Payload or a plain dict
 
     it should raise an AuthError if permissions are not included in the payload
         !!NOTE check your RBAC settings in Auth0
     it should raise an AuthError if the requested permission string is not in the payload permissions array
+        or if the payload permissions do not satisfy the Requirement
     return true otherwise
 '''
 
 
 def check_permissions(permission, payload):
-    if 'permissions' not in payload:
-        raise AuthError({
-            'code': 'invalid_claims',
-            'description': 'Permissions not included in JWT.'
-        }, 400)
+    granted = getattr(payload, 'granted', None)
+    if granted is None:
+        if 'permissions' not in payload:
+            raise AuthError({
+                'code': 'invalid_claims',
+                'description': 'Permissions not included in JWT.'
+            }, 400)
+        granted = frozenset(payload['permissions'])
 
-    # print(permission, payload['permissions'])
-    if permission not in payload['permissions']:
+    if isinstance(permission, Requirement):
+        satisfied = permission.satisfied_by(granted)
+    else:
+        satisfied = permission in granted
+    if not satisfied:
         raise AuthError({
             'code': 'unauthorized',
             'description': 'Permission not found.'
@@ -89,12 +159,189 @@ def check_permissions(permission, payload):
     return True
 
 
+'''
+parse_jwks(jwks)
+    the signing keys of a JWKS document as a {kid: JWK dict} dict, the
+    form jwt.decode accepts with every pinned python-jose. Each key is
+    checked once with jwk.construct, keys that are not for signatures or
+    cannot be parsed are left out.
+'''
+
+
+def parse_jwks(jwks):
+    keys = {}
+    for key in jwks['keys']:
+        if key.get('use', 'sig') != 'sig':
+            continue
+        try:
+            jwk.construct(key, ALGORITHMS[0])
+            keys[key['kid']] = key
+        except (JWKError, KeyError, ValueError) as e:
+            logger.warning('ignoring JWKS key %s: %s', key.get('kid'), e)
+    return keys
+
+
+'''
+JWKSKeyStore
+    in-process cache of the signing keys published at a JWKS url
+
+    keys are fresh for the Cache-Control max-age of the response (or ttl),
+    then served stale for stale_ttl more seconds while a single background
+    thread refetches them. Only one fetch runs at a time, concurrent callers
+    wait for it instead of issuing their own, and no two fetches start
+    within min_refresh_interval seconds, which also rate-limits the forced
+    refetch done when a token carries an unknown kid.
+'''
+
+
+class JWKSKeyStore:
+    def __init__(self, url, ttl=JWKS_TTL, stale_ttl=JWKS_STALE_TTL,
+                 min_refresh_interval=JWKS_MIN_REFRESH_INTERVAL,
+                 timeout=JWKS_FETCH_TIMEOUT, clock=time.monotonic):
+        self.url = url
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.min_refresh_interval = min_refresh_interval
+        self.timeout = timeout
+        self.clock = clock
+        self.fetches = 0
+        self._keys = {}
+        self._fresh_until = None
+        self._stale_until = None
+        self._last_attempt = None
+        self._generation = 0
+        self._refresh_lock = threading.Lock()
+        self._background_lock = threading.Lock()
+        self._background = None
+
+    def get_key(self, kid):
+        '''
+        return the key for kid, or None if Auth0 does not publish it
+        '''
+        if kid is None:
+            return None
+        now = self.clock()
+        if self._stale_until is None or now >= self._stale_until:
+            # nothing usable cached, every caller waits for the fetch
+            self.refresh()
+        elif now >= self._fresh_until:
+            self._refresh_in_background()
+
+        key = self._lookup(kid)
+        if key is None:
+            # an unknown kid usually means Auth0 rotated its signing keys
+            self.refresh()
+            key = self._lookup(kid)
+        return key
+
+    def _lookup(self, kid):
+        if self._stale_until is None or self.clock() >= self._stale_until:
+            return None
+        return self._keys.get(kid)
+
+    def refresh(self):
+        '''
+        fetch the keys unless another caller is already doing it, in which
+        case wait for that fetch and reuse its result
+        '''
+        generation = self._generation
+        with self._refresh_lock:
+            if generation != self._generation:
+                return
+            now = self.clock()
+            if self._last_attempt is not None and \
+                    now - self._last_attempt < self.min_refresh_interval:
+                return
+            self._last_attempt = now
+            try:
+                self._fetch()
+            except Exception:
+                logger.exception('unable to fetch JWKS from %s', self.url)
+            finally:
+                self._generation += 1
+
+    def _refresh_in_background(self):
+        with self._background_lock:
+            if self._background is not None and self._background.is_alive():
+                return
+            self._background = threading.Thread(
+                target=self.refresh, name='jwks-refresh', daemon=True)
+            self._background.start()
+
+    def _fetch(self):
+        response = urlopen(self.url, timeout=self.timeout)
+        keys = parse_jwks(json.loads(response.read()))
+        ttl = self._max_age(response.headers.get('Cache-Control'))
+
+        now = self.clock()
+        self._keys = keys
+        self._fresh_until = now + ttl
+        self._stale_until = now + ttl + self.stale_ttl
+        self.fetches += 1
+
+    def _max_age(self, cache_control):
+        if cache_control:
+            if 'no-cache' in cache_control or 'no-store' in cache_control:
+                return 0
+            match = re.search(r'max-age=(\d+)', cache_control)
+            if match:
+                return int(match.group(1))
+        return self.ttl
+
+
+'''
+JWKSFile, PEMKey
+    key providers that never touch the network: the keys of a JWKS document
+    on disk, or a single PEM public key used whatever the kid of the token.
+    Both are checked once when the provider is built, like JWKSKeyStore
+    get_key(kid) returns the key for kid (a JWK dict or the PEM) or None.
+'''
+
+
+class JWKSFile:
+    def __init__(self, path):
+        self.path = path
+        self.fetches = 0
+        with open(path) as f:
+            self._keys = parse_jwks(json.load(f))
+
+    def get_key(self, kid):
+        return self._keys.get(kid)
+
+
+class PEMKey:
+    def __init__(self, pem):
+        self.fetches = 0
+        jwk.construct(pem, ALGORITHMS[0])
+        self._key = pem
+
+    def get_key(self, kid):
+        return self._key
+
+
+def load_key_provider():
+    '''
+    the provider of the signing keys: PEMKey when JWT_PUBLIC_KEY is set,
+    else JWKSFile when JWKS_FILE is set, else JWKSKeyStore fetching JWKS_URL
+    '''
+    if JWT_PUBLIC_KEY:
+        return PEMKey(JWT_PUBLIC_KEY)
+    if JWKS_FILE:
+        return JWKSFile(JWKS_FILE)
+    return JWKSKeyStore(JWKS_URL)
+
+
+key_provider = load_key_provider()
+
+
 '''
     @INPUTS
         token: a json web token (string)
 
-    it should be an Auth0 token with key id (kid)
-    it should verify the token using Auth0 /.well-known/jwks.json
+    it should be an Auth0 token with key id (kid), unless key_provider is
+        a PEMKey
+    it should verify the token using the key of key_provider, the Auth0
+        /.well-known/jwks.json by default
     it should decode the payload from the token
     it should validate the claims
     return the decoded payload
@@ -102,37 +349,28 @@ def check_permissions(permission, payload):
 
 
 def verify_decode_jwt(token):
-    jsonurl = urlopen(f'https://{AUTH0_DOMAIN}/.well-known/jwks.json')
-    jwks = json.loads(jsonurl.read())
     unverified_header = jwt.get_unverified_header(token)
 
-    rsa_key = {}
-    if 'kid' not in unverified_header:
+    with timed('jwks'):
+        rsa_key = key_provider.get_key(unverified_header.get('kid'))
+
+    if rsa_key is None and 'kid' not in unverified_header:
         raise AuthError({
             'code': 'invalid_header',
             'description': 'Authorization malformed.'
         }, 401)
 
-    for key in jwks['keys']:
-        if key['kid'] == unverified_header['kid']:
-            rsa_key = {
-                'kty': key['kty'],
-                'kid': key['kid'],
-                'use': key['use'],
-                'n': key['n'],
-                'e': key['e']
-            }
-
     if rsa_key:
         try:
             # USE THE KEY TO VALIDATE THE JWT
-            payload = jwt.decode(
-                token,
-                rsa_key,
-                algorithms=ALGORITHMS,
-                audience=API_AUDIENCE,
-                issuer='https://' + AUTH0_DOMAIN + '/'
-            )
+            with timed('jwt'):
+                payload = jwt.decode(
+                    token,
+                    rsa_key,
+                    algorithms=ALGORITHMS,
+                    audience=API_AUDIENCE,
+                    issuer='https://' + AUTH0_DOMAIN + '/'
+                )
 
             return payload
 
@@ -158,31 +396,125 @@ def verify_decode_jwt(token):
     }, 400)
 
 
+'''
+TokenCache
+    bounded LRU of verified payloads keyed by the sha256 digest of the token
+    requires_auth stores Payload objects, with their compiled permissions
+
+    an entry is dropped once the token's exp is reached, so a cached payload
+    is never returned for a token jwt.decode would reject as expired. Tokens
+    without an exp claim are not cached.
+'''
+
+
+class TokenCache:
+    def __init__(self, maxsize=TOKEN_CACHE_SIZE, clock=time.time):
+        self.maxsize = maxsize
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, token):
+        digest = hashlib.sha256(token.encode()).digest()
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is not None and self.clock() >= entry[1]:
+                del self._entries[digest]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(digest)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, token, payload):
+        expires_at = payload.get('exp')
+        if not isinstance(expires_at, (int, float)) or self.maxsize <= 0:
+            return
+        digest = hashlib.sha256(token.encode()).digest()
+        with self._lock:
+            self._entries[digest] = (payload, expires_at)
+            self._entries.move_to_end(digest)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': len(self._entries),
+            'maxsize': self.maxsize
+        }
+
+
+token_cache = TokenCache()
+
+
+# Requirement of each function decorated by requires_auth, filled at import
+permission_requirements = {}
+
 '''
     @INPUTS
-        permission: string permission (i.e. 'post:drink')
+        permissions: string permissions (i.e. 'post:drink'), all required
+        any_of: string permissions, at least one of them required
 
     it should use the get_token_auth_header method to get the token
+    it should reuse the payload cached in token_cache for a known token
     it should use the verify_decode_jwt method to decode the jwt
-    it should use the check_permissions method validate claims and check the requested permission
+    it should use the check_permissions method validate claims and check the requested permissions
+    it should register the requirement in permission_requirements
     return the decorator which passes the decoded payload to the decorated method
 '''
 
 
-def requires_auth(permission=''):
+def requires_auth(*permissions, any_of=()):
+    requirement = Requirement(permissions, any_of)
+
     def requires_auth_decorator(f):
         @wraps(f)
         def wrapper(*args, **kwargs):
-            token = get_token_auth_header()
-            try:
-                payload = verify_decode_jwt(token)
-            except:
-                raise AuthError({
-                    'code': 'unauthorized',
-                    'description': 'incorrect permission'
-                }, 401)
-            check_permissions(permission, payload)
+            with timed('auth'):
+                token = get_token_auth_header()
+                payload = token_cache.get(token)
+                if payload is None:
+                    try:
+                        payload = Payload(verify_decode_jwt(token))
+                    except:
+                        raise AuthError({
+                            'code': 'unauthorized',
+                            'description': 'incorrect permission'
+                        }, 401)
+                    token_cache.set(token, payload)
+                check_permissions(requirement, payload)
             return f(payload, *args, **kwargs)
 
+        permission_requirements[wrapper] = requirement
         return wrapper
     return requires_auth_decorator
+
+
+def permission_table(app):
+    '''
+    the permissions required by each route of app, sorted by route
+    '''
+    table = []
+    for rule in app.url_map.iter_rules():
+        requirement = permission_requirements.get(
+            app.view_functions[rule.endpoint])
+        if requirement is None:
+            continue
+        table.append({
+            'route': rule.rule,
+            'methods': sorted(rule.methods - {'HEAD', 'OPTIONS'}),
+            'all_of': sorted(requirement.all_of),
+            'any_of': sorted(requirement.any_of),
+        })
+    table.sort(key=lambda item: (item['route'], item['methods']))
+    return table
@@ -0,0 +1,740 @@
+'''
+bench.py
+    offline benchmarks for the casting agency API
+
+    runs against a throwaway SQLite database (or BENCH_DATABASE_URL) with
+    tokens minted by tokens.py, whose key is read from a JWKS_FILE, so no
+    Auth0 account or Postgres server is needed
+
+    python bench.py writes --rows 10000 100000
+    python bench.py serialize --rows 1000 10000 100000
+    python bench.py encode --rows 100000
+    python bench.py serve --worker-classes sync gthread gevent
+    python bench.py endpoints --rows 10000 --concurrency 8
+    python bench.py startup --repeat 5
+    python bench.py seeding --rows 1000 10000
+'''
+import argparse
+import datetime
+import http.client
+import itertools
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+from tokens import ROLES, jwks, mint_token
+
+BENCH_DIR = tempfile.mkdtemp(prefix="casting-bench-")
+
+# the app modules read their configuration at import time
+os.environ.setdefault("AUTH0_DOMAIN", "casting-bench.local")
+os.environ.setdefault("ALGORITHMS", "RS256")
+os.environ.setdefault("API_AUDIENCE", "casting")
+os.environ["DATABASE_URL"] = os.environ.get(
+    "BENCH_DATABASE_URL",
+    "sqlite:///" + os.path.join(BENCH_DIR, "bench.db"))
+# the signing key of the minted tokens, also read by the gunicorn workers
+os.environ["JWKS_FILE"] = os.path.join(BENCH_DIR, "jwks.json")
+with open(os.environ["JWKS_FILE"], "w") as f:
+    json.dump(jwks(), f)
+
+from flask import json as flask_json  # noqa: E402
+import cache  # noqa: E402
+import encoder  # noqa: E402
+from api import app  # noqa: E402
+from models import db, Actor, Movie, movie_cast  # noqa: E402
+from models import bulk_insert, unit_of_work  # noqa: E402
+
+
+def seed(rows, batch_size=10000, cast=0):
+    '''
+    drop the tables and insert rows actors and rows movies in a few large
+    batches, with cast actors in each movie
+    '''
+    # recreated tables get new version epochs, no cached list survives
+    db.drop_all()
+    db.create_all()
+    first_release = datetime.datetime(1950, 1, 1)
+    for start in range(0, rows, batch_size):
+        stop = min(start + batch_size, rows)
+        db.session.bulk_insert_mappings(Actor, [
+            {"name": "Actor %d" % i, "age": 20 + i % 60,
+             "gender": "Female" if i % 2 else "Male"}
+            for i in range(start, stop)
+        ])
+        db.session.bulk_insert_mappings(Movie, [
+            {"title": "Movie %d" % i,
+             "release": first_release + datetime.timedelta(days=i % 25000)}
+            for i in range(start, stop)
+        ])
+        if cast:
+            db.session.execute(movie_cast.insert(), [
+                {"movie_id": i + 1, "actor_id": (i + k) % rows + 1}
+                for i in range(start, stop) for k in range(min(cast, rows))
+            ])
+    db.session.commit()
+
+
+def timed(func, repeat):
+    '''
+    call func repeat times, return the latencies in milliseconds
+    '''
+    samples = []
+    for i in range(repeat):
+        started = time.perf_counter()
+        func(i)
+        samples.append((time.perf_counter() - started) * 1000)
+    return samples
+
+
+def report(label, samples):
+    print("{:<40} median {:>9.2f} ms   max {:>9.2f} ms".format(
+        label, statistics.median(samples), max(samples)))
+
+
+def bench_writes(args):
+    '''
+    latency of POST/PATCH/DELETE /actors with and without the full listing
+    '''
+    client = app.test_client()
+    headers = {"Authorization": mint_token(ROLES["producer"])}
+
+    for rows in args.rows:
+        seed(rows)
+        print("\n{} actors".format(rows))
+        for mode, suffix in enumerate(("", "?include_list=true")):
+            # each mode deletes its own range of ids
+            last_id = rows - mode * args.repeat
+
+            def post(i):
+                res = client.post("/actors" + suffix, headers=headers, json={
+                    "name": "New actor", "age": 30, "gender": "Female"})
+                assert res.status_code == 200, res.data
+
+            def patch(i):
+                res = client.patch("/actors/%d%s" % (i + 1, suffix),
+                                   headers=headers, json={"age": 31})
+                assert res.status_code == 200, res.data
+
+            def delete(i):
+                res = client.delete("/actors/%d%s" % (last_id - i, suffix),
+                                    headers=headers)
+                assert res.status_code == 200, res.data
+
+            label = suffix or "(single resource)"
+            report("POST /actors " + label, timed(post, args.repeat))
+            report("PATCH /actors/<id> " + label, timed(patch, args.repeat))
+            report("DELETE /actors/<id> " + label, timed(delete, args.repeat))
+
+
+def bench_serialize(args):
+    '''
+    time to list a whole table through ORM objects and format(), against
+    the tuple rows and format_rows() fast path
+    '''
+    for rows in args.rows:
+        seed(rows)
+        print("\n{} rows".format(rows))
+        for model in (Actor, Movie):
+            def orm(i):
+                [m.format() for m in model.query.all()]
+                db.session.expunge_all()
+
+            def tuples(i):
+                model.format_rows(model.rows().all())
+
+            name = model.__tablename__
+            report(name + " query.all() + format()", timed(orm, args.repeat))
+            report(name + " rows() + format_rows()",
+                   timed(tuples, args.repeat))
+
+
+def bench_encode(args):
+    '''
+    time to encode a large list payload with flask.json, which jsonify used
+    before, and with each installed encoder backend
+    '''
+    for rows in args.rows:
+        payload = {"success": True, "next_cursor": None, "actors": [
+            {"id": i, "name": "Actor %d" % i, "age": 20 + i % 60,
+             "gender": "Female" if i % 2 else "Male"}
+            for i in range(rows)
+        ]}
+        print("\n{} actors".format(rows))
+        report("flask.json", timed(
+            lambda i: flask_json.dumps(payload), args.repeat))
+        for name, backend in encoder.BACKENDS.items():
+            try:
+                dumps = backend()
+            except (ImportError, TypeError):
+                print("{:<40} not installed".format(name))
+                continue
+            report(name, timed(lambda i: dumps(payload), args.repeat))
+
+
+def bench_seeding(args):
+    '''
+    rows per second written by Model.insert(), as db_drop_and_create_all
+    does, with a commit per row or a single unit_of_work, against
+    bulk_insert
+    '''
+    first_release = datetime.datetime(1950, 1, 1)
+
+    def actor(i):
+        return {"name": "Actor %d" % i, "age": 20 + i % 60,
+                "gender": "Female" if i % 2 else "Male"}
+
+    def movie(i):
+        return {"title": "Movie %d" % i,
+                "release": first_release + datetime.timedelta(days=i)}
+
+    def per_row(rows):
+        for i in range(rows):
+            Actor(**actor(i)).insert()
+            Movie(**movie(i)).insert()
+
+    def in_unit(rows):
+        with unit_of_work():
+            per_row(rows)
+
+    def bulk(rows):
+        bulk_insert(Actor, [actor(i) for i in range(rows)])
+        bulk_insert(Movie, [movie(i) for i in range(rows)])
+
+    for rows in args.rows:
+        print("\n{} actors and {} movies".format(rows, rows))
+        for label, write in (("insert(), commit per row", per_row),
+                             ("insert() in unit_of_work", in_unit),
+                             ("bulk_insert", bulk)):
+            db.drop_all()
+            db.create_all()
+            started = time.perf_counter()
+            write(rows)
+            elapsed = time.perf_counter() - started
+            print("{:<40} {:>10.0f} rows/s".format(label, 2 * rows / elapsed))
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def rss_kb(pid):
+    '''
+    resident memory of pid and its children (the gunicorn workers), Linux
+    only
+    '''
+    total = 0
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open("/proc/%s/stat" % entry) as f:
+                parent = int(f.read().rsplit(")", 1)[1].split()[1])
+            if int(entry) != pid and parent != pid:
+                continue
+            with open("/proc/%s/status" % entry) as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1])
+        except (OSError, ValueError):
+            continue
+    return total
+
+
+def start_gunicorn(worker_class, args, **environ):
+    '''
+    start gunicorn with gunicorn.conf.py and worker_class, return the
+    process and its port once it accepts connections, environ is added to
+    the environment of gunicorn
+    '''
+    port = free_port()
+    env = dict(os.environ, GUNICORN_WORKER_CLASS=worker_class,
+               WEB_CONCURRENCY=str(args.workers), PORT=str(port),
+               GUNICORN_THREADS=str(args.threads),
+               RESPONSE_CACHE_SIZE="0", **environ)
+    server = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py",
+         "--log-level", "warning", "api:app"],
+        cwd=os.path.dirname(os.path.abspath(__file__)), env=env)
+    for _ in range(100):
+        try:
+            socket.create_connection(("127.0.0.1", port), 0.1).close()
+            return server, port
+        except OSError:
+            time.sleep(0.1)
+    server.terminate()
+    raise RuntimeError("gunicorn did not start")
+
+
+def load(port, path, headers, concurrency, duration):
+    '''
+    send requests from concurrency keep-alive clients for duration seconds,
+    return the latencies in milliseconds and the number of errors
+    '''
+    samples = []
+    errors = []
+    deadline = time.perf_counter() + duration
+
+    def client():
+        connection = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            try:
+                connection.request("GET", path, headers=headers)
+                response = connection.getresponse()
+                response.read()
+                if response.status != 200:
+                    errors.append(response.status)
+            except (OSError, http.client.HTTPException) as e:
+                errors.append(e)
+                connection.close()
+                continue
+            samples.append((time.perf_counter() - started) * 1000)
+        connection.close()
+
+    clients = [threading.Thread(target=client) for _ in range(concurrency)]
+    for thread in clients:
+        thread.start()
+    for thread in clients:
+        thread.join()
+    return samples, len(errors)
+
+
+def bench_serve(args):
+    '''
+    requests per second, latency and memory of gunicorn serving GET
+    requests with each worker class, against the same seeded database
+    '''
+    seed(args.rows)
+    headers = {"Authorization": mint_token(ROLES["producer"])}
+    for worker_class in args.worker_classes:
+        try:
+            server, port = start_gunicorn(worker_class, args)
+        except RuntimeError as e:
+            print("{:<10} {}".format(worker_class, e))
+            continue
+        try:
+            # warm up the workers and their token cache
+            load(port, args.path, headers, args.concurrency, 1)
+            samples, errors = load(port, args.path, headers,
+                                   args.concurrency, args.duration)
+            rss = rss_kb(server.pid) / 1024
+        finally:
+            server.terminate()
+            server.wait()
+        samples.sort()
+        print("{:<10} {:>8.1f} req/s   p50 {:>8.2f} ms   p99 {:>8.2f} ms   "
+              "errors {:>4}   rss {:>6.1f} MB ({:.2f} MB per connection)"
+              .format(worker_class, len(samples) / args.duration,
+                      statistics.median(samples),
+                      samples[int(len(samples) * 0.99)], errors,
+                      rss, rss / args.concurrency))
+
+
+def percentile(samples, p):
+    '''
+    nearest-rank percentile of sorted samples
+    '''
+    return samples[min(len(samples) - 1, int(len(samples) * p / 100))]
+
+
+def endpoints(rows, batch):
+    '''
+    (name, setup, request) of every endpoint of api.py
+
+    setup(count) runs before the timed requests and prepares what they
+    consume, i.e. the rows a DELETE removes, request(i, prepared) returns
+    the method, path and json body of the i-th request
+    '''
+    def nothing(count):
+        return None
+
+    def new_actors(count):
+        return bulk_insert(Actor, [
+            {"name": "Deleted actor", "age": 30, "gender": "Male"}
+            for _ in range(count)])
+
+    def new_movies(count):
+        return bulk_insert(Movie, [
+            {"title": "Deleted movie",
+             "release": datetime.datetime(2000, 1, 1)}
+            for _ in range(count)])
+
+    def cast_rows(count):
+        return db.session.query(
+            movie_cast.c.movie_id, movie_cast.c.actor_id).limit(count).all()
+
+    def batches(create):
+        def setup(count):
+            ids = create(count * batch)
+            return [ids[i:i + batch] for i in range(0, len(ids), batch)]
+        return setup
+
+    def row_id(i):
+        return i % rows + 1
+
+    actor = {"name": "Bench actor", "age": 40, "gender": "Female"}
+    movie = {"title": "Bench movie", "release": "2001-01-01"}
+
+    def get(path):
+        return lambda i, prepared: ("GET", path, None)
+
+    return [
+        ("GET /actors", nothing, get("/actors?limit=100")),
+        ("GET /actors?name_prefix", nothing,
+         get("/actors?name_prefix=Actor%2012&limit=100")),
+        ("GET /actors?embed=movies", nothing,
+         get("/actors?embed=movies&limit=100")),
+        ("GET /movies", nothing, get("/movies?limit=100")),
+        ("GET /movies?released_after", nothing,
+         get("/movies?released_after=1952-01-01&limit=100")),
+        ("GET /movies?embed=actors", nothing,
+         get("/movies?embed=actors&limit=100")),
+        ("GET /movies/<id>/actors", nothing, lambda i, prepared: (
+            "GET", "/movies/%d/actors" % row_id(i), None)),
+        ("GET /actors/<id>/movies", nothing, lambda i, prepared: (
+            "GET", "/actors/%d/movies" % row_id(i), None)),
+        ("GET /search", nothing, get("/search?q=Actor%2012&limit=20")),
+        ("GET /actors/export", nothing, get("/actors/export")),
+        ("GET /movies/export", nothing, get("/movies/export?format=json")),
+        ("POST /actors", nothing, lambda i, prepared: (
+            "POST", "/actors", actor)),
+        ("POST /movies", nothing, lambda i, prepared: (
+            "POST", "/movies", movie)),
+        ("PATCH /actors/<id>", nothing, lambda i, prepared: (
+            "PATCH", "/actors/%d" % row_id(i), {"age": 41})),
+        ("PATCH /movies/<id>", nothing, lambda i, prepared: (
+            "PATCH", "/movies/%d" % row_id(i), {"title": "Renamed"})),
+        ("DELETE /actors/<id>", new_actors, lambda i, prepared: (
+            "DELETE", "/actors/%d" % prepared[i], None)),
+        ("DELETE /movies/<id>", new_movies, lambda i, prepared: (
+            "DELETE", "/movies/%d" % prepared[i], None)),
+        ("POST /movies/<id>/actors", nothing, lambda i, prepared: (
+            "POST", "/movies/%d/actors" % row_id(i),
+            {"actor_ids": [row_id(i * 7), row_id(i * 13)]})),
+        ("DELETE /movies/<id>/actors/<id>", cast_rows, lambda i, prepared: (
+            "DELETE", "/movies/%d/actors/%d" % tuple(prepared[i]), None)),
+        ("POST /actors/bulk", nothing, lambda i, prepared: (
+            "POST", "/actors/bulk", [actor] * batch)),
+        ("POST /movies/bulk", nothing, lambda i, prepared: (
+            "POST", "/movies/bulk", [movie] * batch)),
+        ("PATCH /actors/bulk", nothing, lambda i, prepared: (
+            "PATCH", "/actors/bulk",
+            [{"id": row_id(i * batch + k), "age": 42}
+             for k in range(batch)])),
+        ("PATCH /movies/bulk", nothing, lambda i, prepared: (
+            "PATCH", "/movies/bulk",
+            [{"id": row_id(i * batch + k), "title": "Renamed"}
+             for k in range(batch)])),
+        ("DELETE /actors/bulk", batches(new_actors), lambda i, prepared: (
+            "DELETE", "/actors/bulk", prepared[i])),
+        ("DELETE /movies/bulk", batches(new_movies), lambda i, prepared: (
+            "DELETE", "/movies/bulk", prepared[i])),
+    ]
+
+
+def drive(send, request, prepared, count, concurrency):
+    '''
+    send count requests from concurrency threads, each thread getting its
+    own sender from send(), return the sorted latencies in milliseconds,
+    the wall time in seconds and the unexpected statuses
+    '''
+    counter = itertools.count()
+    samples = []
+    failures = []
+
+    def worker():
+        sender = send()
+        while True:
+            i = next(counter)
+            if i >= count:
+                return
+            method, path, body = request(i, prepared)
+            started = time.perf_counter()
+            status = sender(method, path, body)
+            samples.append((time.perf_counter() - started) * 1000)
+            if status not in (200, 201):
+                failures.append(status)
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return sorted(samples), time.perf_counter() - started, failures
+
+
+def in_process(headers):
+    '''
+    sender calling the app through the WSGI test client
+    '''
+    def send():
+        client = app.test_client()
+
+        def sender(method, path, body):
+            response = client.open(path, method=method, headers=headers,
+                                   json=body, buffered=False)
+            # streamed responses are only produced when read, chunks are
+            # dropped as a network client would
+            for chunk in response.response:
+                pass
+            response.close()
+            return response.status_code
+        return sender
+    return send
+
+
+def over_http(port, headers):
+    '''
+    sender calling a server on localhost through a keep-alive connection
+    '''
+    def send():
+        connection = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+
+        def sender(method, path, body):
+            request_headers = dict(headers)
+            payload = None
+            if body is not None:
+                payload = json.dumps(body)
+                request_headers["Content-Type"] = "application/json"
+            try:
+                connection.request(method, path, payload, request_headers)
+                response = connection.getresponse()
+                response.read()
+                return response.status
+            except (OSError, http.client.HTTPException) as e:
+                connection.close()
+                return type(e).__name__
+        return sender
+    return send
+
+
+def allocated_kb(send, request, prepared, count):
+    '''
+    mean peak of the memory traced by tracemalloc while serving one request
+    '''
+    sender = send()
+    peaks = []
+    for i in range(count):
+        method, path, body = request(i, prepared)
+        tracemalloc.start()
+        try:
+            sender(method, path, body)
+            peaks.append(tracemalloc.get_traced_memory()[1])
+        finally:
+            tracemalloc.stop()
+    return statistics.mean(peaks) / 1024
+
+
+def bench_endpoints(args):
+    '''
+    latency percentiles, throughput and memory allocated per request of
+    every endpoint, in process or against gunicorn
+    '''
+    seed(args.rows, cast=3)
+    headers = {"Authorization": mint_token(ROLES["producer"])}
+    # without the response cache, repeated GETs measure the actual work
+    cache.RESPONSE_CACHE_SIZE = args.response_cache_size
+    server = None
+    if args.worker_class:
+        server, port = start_gunicorn(args.worker_class, args)
+        send = over_http(port, headers)
+    else:
+        send = in_process(headers)
+
+    # first requests fill the token cache and open the database connections
+    drive(send, lambda i, prepared: ("GET", "/actors?limit=1", None),
+          None, args.concurrency * 4, args.concurrency)
+
+    names = args.only or []
+    print("{:<34} {:>9} {:>9} {:>9} {:>9} {:>7} {:>10}".format(
+        "endpoint", "req/s", "p50 ms", "p95 ms", "p99 ms", "errors",
+        "alloc KB"))
+    try:
+        for name, setup, request in endpoints(args.rows, args.batch):
+            if names and not any(part in name for part in names):
+                continue
+            # allocations are measured in process only, after the timed run
+            alloc = args.alloc_requests if server is None else 0
+            prepared = setup(args.requests + alloc)
+            samples, elapsed, failures = drive(
+                send, request, prepared, args.requests, args.concurrency)
+            allocated = None
+            if alloc:
+                rest = prepared[args.requests:] if prepared else prepared
+                allocated = allocated_kb(send, request, rest, alloc)
+            print("{:<34} {:>9.1f} {:>9.2f} {:>9.2f} {:>9.2f} {:>7} {:>10}"
+                  .format(name, len(samples) / elapsed,
+                          percentile(samples, 50), percentile(samples, 95),
+                          percentile(samples, 99), len(failures),
+                          "-" if allocated is None else
+                          "%.1f" % allocated))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+
+# run in a fresh interpreter by bench_startup, prints the seconds spent
+# importing api, building the app and answering the first request
+STARTUP_SCRIPT = '''
+import sys, time
+started = time.perf_counter()
+import api
+imported = time.perf_counter()
+app = api.create_app()
+built = time.perf_counter()
+response = app.test_client().get(
+    "/actors?limit=1", headers={"Authorization": sys.argv[1]})
+answered = time.perf_counter()
+assert response.status_code == 200, response.status
+print(imported - started, built - imported, answered - built)
+'''
+
+
+def first_response_ms(worker_class, args, preload):
+    '''
+    milliseconds from starting gunicorn to its first 200 response
+    '''
+    headers = {"Authorization": mint_token(ROLES["producer"])}
+    started = time.perf_counter()
+    server, port = start_gunicorn(
+        worker_class, args, GUNICORN_PRELOAD=str(preload).lower())
+    try:
+        while time.perf_counter() - started < 30:
+            connection = http.client.HTTPConnection(
+                "127.0.0.1", port, timeout=30)
+            try:
+                connection.request("GET", "/actors?limit=1", headers=headers)
+                if connection.getresponse().status == 200:
+                    return (time.perf_counter() - started) * 1000
+            except (OSError, http.client.HTTPException):
+                pass
+            finally:
+                connection.close()
+            time.sleep(0.01)
+        raise RuntimeError("gunicorn did not answer")
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def bench_startup(args):
+    '''
+    cold start: time to import api, build the app and answer the first
+    request in a fresh interpreter, and time for gunicorn to answer its
+    first request with and without preload_app
+    '''
+    seed(args.rows)
+    token = mint_token(ROLES["producer"])
+    phases = ([], [], [], [])
+    for _ in range(args.repeat):
+        started = time.perf_counter()
+        output = subprocess.run(
+            [sys.executable, "-c", STARTUP_SCRIPT, token],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            check=True, stdout=subprocess.PIPE).stdout
+        total = time.perf_counter() - started
+        for samples, seconds in zip(phases, output.split() + [total]):
+            samples.append(float(seconds) * 1000)
+    for label, samples in zip(("import api", "create_app()",
+                               "first request", "process total"), phases):
+        report(label, samples)
+
+    for worker_class in args.worker_classes:
+        for preload in (False, True):
+            try:
+                samples = [first_response_ms(worker_class, args, preload)
+                           for _ in range(args.repeat)]
+            except RuntimeError as e:
+                print("{:<40} {}".format(worker_class, e))
+                break
+            report("gunicorn {} preload={}".format(
+                worker_class, str(preload).lower()), samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[2].strip())
+    commands = parser.add_subparsers(dest="command")
+    commands.required = True
+
+    writes = commands.add_parser("writes", help=bench_writes.__doc__.strip())
+    writes.add_argument("--rows", type=int, nargs="+", default=[10000, 100000])
+    writes.add_argument("--repeat", type=int, default=20)
+    writes.set_defaults(func=bench_writes)
+
+    serialize = commands.add_parser(
+        "serialize", help=bench_serialize.__doc__.strip())
+    serialize.add_argument("--rows", type=int, nargs="+",
+                           default=[1000, 10000, 100000])
+    serialize.add_argument("--repeat", type=int, default=5)
+    serialize.set_defaults(func=bench_serialize)
+
+    encode = commands.add_parser("encode", help=bench_encode.__doc__.strip())
+    encode.add_argument("--rows", type=int, nargs="+", default=[100000])
+    encode.add_argument("--repeat", type=int, default=10)
+    encode.set_defaults(func=bench_encode)
+
+    serve = commands.add_parser("serve", help=bench_serve.__doc__.strip())
+    serve.add_argument("--worker-classes", nargs="+",
+                       default=["sync", "gthread", "gevent"])
+    serve.add_argument("--workers", type=int, default=2)
+    serve.add_argument("--threads", type=int, default=8)
+    serve.add_argument("--concurrency", type=int, default=32)
+    serve.add_argument("--duration", type=float, default=10)
+    serve.add_argument("--rows", type=int, default=10000)
+    serve.add_argument("--path", default="/actors?limit=20")
+    serve.set_defaults(func=bench_serve)
+
+    bench = commands.add_parser(
+        "endpoints", help=bench_endpoints.__doc__.strip())
+    bench.add_argument("--rows", type=int, default=10000)
+    bench.add_argument("--requests", type=int, default=200)
+    bench.add_argument("--concurrency", type=int, default=8)
+    bench.add_argument("--batch", type=int, default=100,
+                       help="items per bulk request")
+    bench.add_argument("--alloc-requests", type=int, default=20)
+    bench.add_argument("--response-cache-size", type=int, default=0)
+    bench.add_argument("--only", nargs="+",
+                       help="run the endpoints whose name contains one of "
+                            "these strings")
+    bench.add_argument("--worker-class",
+                       help="serve with gunicorn and this worker class "
+                            "instead of calling the app in process")
+    bench.add_argument("--workers", type=int, default=2)
+    bench.add_argument("--threads", type=int, default=8)
+    bench.set_defaults(func=bench_endpoints)
+
+    seeding = commands.add_parser(
+        "seeding", help=bench_seeding.__doc__.strip())
+    seeding.add_argument("--rows", type=int, nargs="+",
+                         default=[1000, 10000])
+    seeding.set_defaults(func=bench_seeding)
+
+    startup = commands.add_parser(
+        "startup", help=bench_startup.__doc__.strip())
+    startup.add_argument("--repeat", type=int, default=5)
+    startup.add_argument("--rows", type=int, default=1000)
+    startup.add_argument("--worker-classes", nargs="+",
+                         default=["sync", "gthread"])
+    startup.add_argument("--workers", type=int, default=2)
+    startup.add_argument("--threads", type=int, default=8)
+    startup.set_defaults(func=bench_startup)
+
+    args = parser.parse_args()
+    with app.app_context():
+        args.func(args)
+
+
+if __name__ == "__main__":
+    main()
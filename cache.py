@@ -0,0 +1,176 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from flask import current_app, g, has_request_context, make_response
+from flask import request
+from urllib.parse import urlencode
+from models import read_versions
+
+# number of responses kept per worker, 0 disables the response cache
+RESPONSE_CACHE_SIZE = int(os.environ.get('RESPONSE_CACHE_SIZE', 512))
+# seconds a cached response is kept even if its tables do not change
+RESPONSE_CACHE_TTL = int(os.environ.get('RESPONSE_CACHE_TTL', 300))
+# redis://host:port/db to share the cached responses between workers
+RESPONSE_CACHE_URL = os.environ.get('RESPONSE_CACHE_URL')
+
+RESPONSE_PREFIX = 'response:'
+
+'''
+LocalCache
+    in-process LRU, the default cache backend
+
+    a backend is anything exposing the subset of the redis client used here:
+    get(key) and set(key, value, ex=seconds), so a redis.Redis client (or a
+    local stand-in with the same methods) can replace it when several
+    workers must share cached responses
+'''
+
+
+class LocalCache:
+    def __init__(self, maxsize=RESPONSE_CACHE_SIZE, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.clock = clock
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at is not None and self.clock() >= expires_at:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ex=None):
+        expires_at = None if ex is None else self.clock() + ex
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+
+def create_backend():
+    if RESPONSE_CACHE_URL:
+        import redis
+        return redis.Redis.from_url(RESPONSE_CACHE_URL)
+    return LocalCache()
+
+
+backend = create_backend()
+stats = {'hits': 0, 'misses': 0}
+
+
+'''
+table_version(table)
+    per-table change version, read from the table_versions table that every
+    write path in models.py bumps in its transaction, so anything derived
+    from a version is stale once a write commits, whichever process made it
+'''
+
+
+def table_version(table):
+    return read_versions([table])[table]
+
+
+def request_versions(tables):
+    '''
+    versions of tables, read once per request: conditional_response,
+    cached_response and the search fallback index of one request share a
+    single table_versions lookup
+    '''
+    if not has_request_context():
+        return read_versions(tables)
+    known = g.setdefault('table_versions', {})
+    missing = [table for table in tables if table not in known]
+    if missing:
+        known.update(read_versions(missing))
+    return {table: known[table] for table in tables}
+
+
+def representation_key(tables):
+    '''
+    versions of tables, path and sorted query string of the current request
+    '''
+    versions = request_versions(tables)
+    return '{}:{}?{}'.format(
+        ','.join(versions[table] for table in tables),
+        request.path,
+        urlencode(sorted(request.args.items(multi=True))))
+
+
+'''
+cached_response(*tables)
+    cache the body of successful responses of the decorated view, keyed by
+    path, query string and the versions of the tables it reads from
+
+    a write to any of the tables bumps its version in the database, so the
+    next request of every worker builds a new key and misses, old entries
+    age out of the LRU. Use it below requires_auth so permissions are
+    checked on every request.
+'''
+
+
+def cached_response(*tables):
+    def cached_response_decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            if RESPONSE_CACHE_SIZE <= 0:
+                return f(*args, **kwargs)
+
+            # versions are read before the rows, so a concurrent write can
+            # only make the cached body newer than its key, never older
+            key = RESPONSE_PREFIX + representation_key(tables)
+            body = backend.get(key)
+            if body is not None:
+                stats['hits'] += 1
+                return current_app.response_class(
+                    body, mimetype='application/json')
+
+            stats['misses'] += 1
+            response = make_response(f(*args, **kwargs))
+            if response.status_code == 200:
+                backend.set(key, response.get_data(), ex=RESPONSE_CACHE_TTL)
+            return response
+
+        return wrapper
+    return cached_response_decorator
+
+
+'''
+conditional_response(*tables)
+    strong ETag derived from the committed versions (table_versions) of the
+    tables the decorated view reads from, answers If-None-Match with 304
+    before the view runs, so while nothing changed pollers cost a single
+    table_versions lookup (shared with cached_response) and no
+    serialization, whichever process wrote last.
+    Use it below requires_auth and above cached_response.
+'''
+
+
+def conditional_response(*tables):
+    def conditional_response_decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            etag = hashlib.sha1(
+                representation_key(tables).encode()).hexdigest()
+            if request.if_none_match.contains(etag):
+                response = current_app.response_class(status=304)
+            else:
+                response = make_response(f(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag)
+            # responses depend on the token, browsers must revalidate them
+            response.headers['Cache-Control'] = 'private, no-cache'
+            return response
+
+        return wrapper
+    return conditional_response_decorator
@@ -0,0 +1,199 @@
+import csv
+import datetime
+import io
+import itertools
+import json
+import random
+import time
+from dateutil.parser import isoparse
+from models import db, commit, unit_of_work, Actor, Movie
+
+# rows sent per COPY or executemany
+IMPORT_BATCH_SIZE = 10000
+FORMATS = ('csv', 'ndjson')
+
+MODELS = {'actors': Actor, 'movies': Movie}
+
+
+def optional(convert):
+    '''
+    convert a field, an empty field (or a missing one) being NULL
+    '''
+    def converter(value):
+        if value is None or value == '':
+            return None
+        return convert(value)
+    return converter
+
+
+# the columns of each table read from a file, with their conversion
+COLUMNS = {
+    'actors': (('name', optional(str)), ('age', optional(int)),
+               ('gender', optional(str))),
+    'movies': (('title', optional(str)), ('release', optional(isoparse))),
+}
+
+'''
+dataset
+    stream actors and movies between CSV or NDJSON files and the database
+
+    files hold one record per line (after the header row of a CSV file)
+    with the fields of COLUMNS, ids are assigned by the database. Imports
+    read the file lazily and write it in batches of IMPORT_BATCH_SIZE rows,
+    with COPY on Postgres and an executemany INSERT elsewhere, all in a
+    single transaction: a malformed record imports nothing.
+'''
+
+
+def file_format(path, format=None):
+    if format:
+        return format
+    return 'csv' if path.endswith('.csv') else 'ndjson'
+
+
+def read_rows(f, table, format):
+    '''
+    the rows of table read from the open file f, one tuple per record in
+    the order of COLUMNS[table], ValueError names a malformed record
+    '''
+    columns = COLUMNS[table]
+    if format == 'csv':
+        records = csv.DictReader(f)
+    else:
+        records = (line for line in f if line.strip())
+    for number, record in enumerate(records, 1):
+        try:
+            if format != 'csv':
+                record = json.loads(record)
+            row = tuple(convert(record.get(name))
+                        for name, convert in columns)
+        except (AttributeError, TypeError, ValueError) as e:
+            raise ValueError('record {}: {}'.format(number, e))
+        yield row
+
+
+def copy_value(value):
+    if value is None:
+        return '\\N'
+    if isinstance(value, datetime.datetime):
+        value = value.isoformat()
+    return str(value).replace('\\', '\\\\').replace('\t', '\\t') \
+        .replace('\n', '\\n').replace('\r', '\\r')
+
+
+def copy_text(rows):
+    '''
+    rows in the text format read by COPY ... FROM STDIN
+    '''
+    return ''.join('\t'.join(map(copy_value, row)) + '\n' for row in rows)
+
+
+def copy_batch(table, names, rows):
+    cursor = db.session.connection().connection.cursor()
+    try:
+        cursor.copy_expert(
+            'COPY {} ({}) FROM STDIN'.format(table, ', '.join(names)),
+            io.StringIO(copy_text(rows)))
+    finally:
+        cursor.close()
+
+
+def insert_batch(table, names, rows):
+    db.session.execute(MODELS[table].__table__.insert(),
+                       [dict(zip(names, row)) for row in rows])
+
+
+def import_rows(table, rows, batch_size=IMPORT_BATCH_SIZE):
+    '''
+    write the rows of an iterable into table and bump its version in
+    table_versions, in one transaction, return how many were written
+    '''
+    names = [name for name, convert in COLUMNS[table]]
+    if db.engine.dialect.name == 'postgresql':
+        write = copy_batch
+    else:
+        write = insert_batch
+    rows = iter(rows)
+    count = 0
+    with unit_of_work():
+        while True:
+            batch = list(itertools.islice(rows, batch_size))
+            if not batch:
+                break
+            write(table, names, batch)
+            count += len(batch)
+        commit(table)
+    return count
+
+
+def import_file(path, table, format=None, batch_size=IMPORT_BATCH_SIZE):
+    '''
+    import the records of a file into table, return the number of rows and
+    the seconds it took
+    '''
+    format = file_format(path, format)
+    started = time.perf_counter()
+    with open(path, newline='') as f:
+        count = import_rows(table, read_rows(f, table, format), batch_size)
+    return count, time.perf_counter() - started
+
+
+FIRST_NAMES = (
+    'Ada', 'Ben', 'Chloe', 'Dev', 'Elena', 'Farid', 'Grace', 'Hiro', 'Ines',
+    'Jonas', 'Kemi', 'Liam', 'Maya', 'Nikolai', 'Olga', 'Pablo', 'Quinn',
+    'Rosa', 'Sven', 'Tara', 'Umar', 'Vera', 'Wen', 'Ximena', 'Yusuf', 'Zoe',
+)
+LAST_NAMES = (
+    'Adams', 'Brooks', 'Castillo', 'Dubois', 'Eriksen', 'Fischer', 'Garcia',
+    'Hughes', 'Ito', 'Jensen', 'Kowalski', 'Lopez', 'Moreau', 'Nakamura',
+    'Okafor', 'Patel', 'Quintero', 'Rossi', 'Silva', 'Tanaka', 'Ueda',
+    'Varga', 'Weber', 'Xu', 'Yilmaz', 'Zhang',
+)
+TITLE_WORDS = (
+    'Last', 'Night', 'City', 'Iron', 'Summer', 'Shadow', 'River', 'Echo',
+    'Golden', 'Storm', 'Silent', 'Empire', 'Glass', 'Winter', 'Kingdom',
+    'Lost', 'Star', 'Heart', 'Road', 'Fire', 'Dream', 'Ocean', 'Ghost',
+    'Red', 'Wild', 'Secret', 'Machine', 'Garden', 'Midnight', 'Return',
+)
+FIRST_RELEASE = datetime.date(1920, 1, 1)
+
+
+def generate_records(table, count, seed=0):
+    '''
+    count synthetic records of table, the same seed giving the same records
+    '''
+    rng = random.Random(seed)
+    for i in range(count):
+        if table == 'actors':
+            yield {
+                'name': '{} {}'.format(rng.choice(FIRST_NAMES),
+                                       rng.choice(LAST_NAMES)),
+                'age': rng.randint(18, 90),
+                'gender': rng.choice(('Male', 'Female')),
+            }
+        else:
+            yield {
+                'title': ' '.join(rng.sample(TITLE_WORDS, rng.randint(1, 4))),
+                'release': (FIRST_RELEASE + datetime.timedelta(
+                    days=rng.randrange(105 * 365))).isoformat(),
+            }
+
+
+def write_records(f, table, records, format):
+    names = [name for name, convert in COLUMNS[table]]
+    if format == 'csv':
+        writer = csv.DictWriter(f, names)
+        writer.writeheader()
+        writer.writerows(records)
+    else:
+        for record in records:
+            f.write(json.dumps(record) + '\n')
+
+
+def generate_file(path, table, count, format=None, seed=0):
+    '''
+    write count synthetic records of table to a CSV or NDJSON file
+    '''
+    with open(path, 'w', newline='') as f:
+        write_records(f, table, generate_records(table, count, seed),
+                      file_format(path, format))
@@ -0,0 +1,101 @@
+import datetime
+import json
+import os
+from flask import current_app
+from flask.json import JSONEncoder
+from metrics import timed
+
+# orjson, ujson or json, by default the fastest one installed
+JSON_ENCODER = os.environ.get('JSON_ENCODER', 'auto')
+
+'''
+encoder
+    json encoding for every API response
+
+    dumps(obj) returns utf-8 bytes using orjson or ujson when installed and
+    the standard library otherwise. Datetimes and dates are encoded as ISO
+    8601 strings by every backend.
+'''
+
+
+def json_default(obj):
+    if isinstance(obj, (datetime.datetime, datetime.date)):
+        return obj.isoformat()
+    raise TypeError(
+        'Object of type {} is not JSON serializable'.format(type(obj)))
+
+
+def stdlib_dumps(obj):
+    return json.dumps(
+        obj, default=json_default, separators=(',', ':')).encode('utf-8')
+
+
+def orjson_backend():
+    import orjson
+    return orjson.dumps
+
+
+def ujson_backend():
+    import ujson
+    # ujson < 5 has no default hook and would reject datetimes
+    ujson.dumps(datetime.date.today(), default=json_default)
+    return lambda obj: ujson.dumps(obj, default=json_default).encode('utf-8')
+
+
+BACKENDS = {
+    'orjson': orjson_backend,
+    'ujson': ujson_backend,
+    'json': lambda: stdlib_dumps,
+}
+
+
+def select_backend(name=JSON_ENCODER):
+    '''
+    return (name, dumps) for the requested backend, falling back to the
+    next one when it is not installed
+    '''
+    names = ['orjson', 'ujson', 'json'] if name == 'auto' else [name, 'json']
+    for candidate in names:
+        try:
+            return candidate, BACKENDS[candidate]()
+        except (KeyError, ImportError, TypeError):
+            continue
+
+
+backend_name, dumps = select_backend()
+
+
+def jsonify(*args, **kwargs):
+    '''
+    drop-in replacement for flask.jsonify encoding with the selected backend
+    '''
+    if args and kwargs:
+        raise TypeError('jsonify() behavior undefined when passed both '
+                        'args and kwargs')
+    if len(args) == 1:
+        data = args[0]
+    else:
+        data = args or kwargs
+    with timed('serialize'):
+        body = dumps(data) + b'\n'
+    return current_app.response_class(
+        body, mimetype=current_app.config['JSONIFY_MIMETYPE'])
+
+
+class DateJSONEncoder(JSONEncoder):
+    '''
+    encoder left to flask.json, with the same date format as dumps
+    '''
+
+    def default(self, obj):
+        if isinstance(obj, (datetime.datetime, datetime.date)):
+            return obj.isoformat()
+        return super().default(obj)
+
+
+def init_json(app):
+    '''
+    install the encoder as the app's JSON provider
+    '''
+    app.json_encoder = DateJSONEncoder
+    app.config['JSON_ENCODER_BACKEND'] = backend_name
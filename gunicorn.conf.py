@@ -0,0 +1,60 @@
+'''
+gunicorn.conf.py
+    serving configuration, used by the Procfile: gunicorn -c gunicorn.conf.py
+
+    GUNICORN_WORKER_CLASS picks how a worker serves concurrent requests:
+    - gthread (default): GUNICORN_THREADS threads per worker, the auth and
+      database code release the GIL while they wait on the network
+    - gevent: GUNICORN_WORKER_CONNECTIONS greenlets per worker, requires
+      the gevent package, and psycogreen so psycopg2 yields while waiting
+    - sync: one request at a time per worker, as before
+
+    the connection pool of each worker defaults to its concurrency, so a
+    request never waits for a connection another one of its worker holds
+    (gevent workers are capped at 20 connections, the other greenlets wait
+    for a free one). WEB_CONCURRENCY sets the number of worker processes.
+
+    with GUNICORN_PRELOAD (default true, except for gevent) the master
+    imports and builds the app once before forking, so new workers come
+    online without importing it again. The app opens no connection while
+    it is built; post_fork still drops any pooled connection inherited from
+    the master. gevent workers load the app themselves, after gevent has
+    patched the standard library.
+'''
+import os
+
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+workers = int(os.environ.get('WEB_CONCURRENCY', 1))
+threads = int(os.environ.get('GUNICORN_THREADS', 8))
+worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', 100))
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', 5))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+bind = '0.0.0.0:' + os.environ.get('PORT', '8000')
+preload_app = os.environ.get(
+    'GUNICORN_PRELOAD', str(worker_class != 'gevent')).lower() in (
+    '1', 'true', 'yes')
+
+if worker_class == 'gthread':
+    concurrency = threads
+elif worker_class == 'gevent':
+    concurrency = min(worker_connections, 20)
+else:
+    concurrency = 1
+# read by models.py when the workers import the app
+os.environ.setdefault('DB_POOL_SIZE', str(concurrency))
+
+
+def post_fork(server, worker):
+    if server.cfg.preload_app:
+        # a connection shared by two processes corrupts both sessions
+        from models import db
+        db.get_engine(db.app).dispose()
+    if worker_class != 'gevent':
+        return
+    try:
+        from psycogreen.gevent import patch_psycopg
+    except ImportError as e:
+        server.log.warning(
+            'queries block the gevent worker, psycopg2 is not patched: %s', e)
+        return
+    patch_psycopg()
@@ -3,6 +3,8 @@ from flask_migrate import Migrate, MigrateCommand
 
 from api import app
 from models import db
+from dataset import FORMATS, IMPORT_BATCH_SIZE, MODELS
+from dataset import generate_file, import_file
 
 migrate = Migrate(app, db)
 manager = Manager(app)
@@ -10,5 +12,33 @@ manager = Manager(app)
 manager.add_command('db', MigrateCommand)
 
 
+@manager.option('-b', '--batch-size', dest='batch_size', type=int,
+                default=IMPORT_BATCH_SIZE)
+@manager.option('-f', '--format', dest='format', choices=FORMATS)
+@manager.option('path', help='CSV or NDJSON file')
+@manager.option('table', choices=sorted(MODELS))
+def import_data(table, path, format=None, batch_size=IMPORT_BATCH_SIZE):
+    '''
+    import actors or movies from a CSV or NDJSON file
+    '''
+    if app.config['CREATE_TABLES']:
+        db.create_all()
+    count, seconds = import_file(path, table, format, batch_size)
+    print('imported {} {} in {:.1f} s ({:.0f} rows/s)'.format(
+        count, table, seconds, count / seconds if seconds else 0))
+
+
+@manager.option('-s', '--seed', dest='seed', type=int, default=0)
+@manager.option('-f', '--format', dest='format', choices=FORMATS)
+@manager.option('path', help='CSV or NDJSON file to write')
+@manager.option('count', type=int)
+@manager.option('table', choices=sorted(MODELS))
+def generate(table, count, path, format=None, seed=0):
+    '''
+    write count synthetic actors or movies to a CSV or NDJSON file
+    '''
+    generate_file(path, table, count, format, seed)
+
+
 if __name__ == '__main__':
     manager.run()
@@ -0,0 +1,241 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# add a Server-Timing header with the phases of each request
+SERVER_TIMING = os.environ.get('SERVER_TIMING', 'true').lower() in (
+    '1', 'true', 'yes')
+# bearer token required to read /metrics, open when unset
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
+# upper bounds in seconds, as used by the Prometheus client libraries
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+           1.0, 2.5, 5.0, 10.0)
+
+'''
+Histogram
+    cumulative histogram of observed durations in seconds, in the shape of a
+    Prometheus histogram (per-bucket counts, sum and count)
+'''
+
+
+class Histogram:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        with self._lock:
+            self.sum += value
+            self.count += 1
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    self.counts[i] += 1
+                    break
+
+    def cumulative(self):
+        '''
+        (upper bound, count of values below it) pairs, ending with +Inf
+        '''
+        with self._lock:
+            total = 0
+            result = []
+            for bound, count in zip(self.buckets, self.counts):
+                total += count
+                result.append((bound, total))
+            result.append(('+Inf', self.count))
+            return result, self.sum
+
+
+'''
+Registry
+    histograms of one worker, keyed by metric name and label values
+'''
+
+
+class Registry:
+    def __init__(self):
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def histogram(self, name, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            with self._lock:
+                histogram = self._histograms.setdefault(key, Histogram())
+        return histogram
+
+    def observe(self, name, value, **labels):
+        self.histogram(name, **labels).observe(value)
+
+    def clear(self):
+        with self._lock:
+            self._histograms.clear()
+
+    def exposition(self):
+        '''
+        the histograms in the Prometheus text format
+        '''
+        with self._lock:
+            histograms = sorted(self._histograms.items(),
+                                key=lambda item: item[0])
+        lines = []
+        seen = set()
+        for (name, labels), histogram in histograms:
+            if name not in seen:
+                seen.add(name)
+                lines.append('# TYPE {} histogram'.format(name))
+            buckets, total = histogram.cumulative()
+            for bound, count in buckets:
+                lines.append('{}_bucket{} {}'.format(
+                    name, format_labels(labels + (('le', bound),)), count))
+            lines.append('{}_sum{} {}'.format(
+                name, format_labels(labels), total))
+            lines.append('{}_count{} {}'.format(
+                name, format_labels(labels), buckets[-1][1]))
+        return lines
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(
+        '{}="{}"'.format(name, str(value).replace('\\', '\\\\')
+                         .replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in labels) + '}'
+
+
+def gauges(name, values, help_text):
+    '''
+    one gauge per numeric item of values, i.e. the stats() of a cache
+    '''
+    lines = ['# HELP {} {}'.format(name, help_text),
+             '# TYPE {} gauge'.format(name)]
+    for key, value in sorted(values.items()):
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            lines.append('{}{} {}'.format(
+                name, format_labels((('stat', key),)), value))
+    return lines
+
+
+registry = Registry()
+
+'''
+timed(phase)
+    add the time spent in the block to the phase of the current request,
+    reported in Server-Timing and in the request_phase_seconds histogram.
+    Phases may nest: jwks and jwt are part of auth, and format includes the
+    db time of the rows it iterates. Outside of a request the block is not
+    timed.
+'''
+
+
+@contextmanager
+def timed(phase):
+    if not has_request_context() or 'timings' not in g:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        g.timings[phase] = g.timings.get(phase, 0.0) + \
+            time.perf_counter() - started
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def start_statement(conn, cursor, statement, parameters, context,
+                    executemany):
+    conn.info['statement_started'] = time.perf_counter()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def end_statement(conn, cursor, statement, parameters, context,
+                  executemany):
+    if has_request_context() and 'timings' in g:
+        g.timings['db'] = g.timings.get('db', 0.0) + \
+            time.perf_counter() - conn.info['statement_started']
+
+
+def route_label():
+    return request.url_rule.rule if request.url_rule else 'unmatched'
+
+
+def start_request():
+    g.timings = {}
+    g.request_started = time.perf_counter()
+
+
+def observe_request(route, method, status, started, timings):
+    '''
+    add a finished request to the histograms, return its total duration
+    '''
+    total = time.perf_counter() - started
+    registry.observe('casting_request_duration_seconds', total,
+                     route=route, method=method, status=status)
+    for phase, seconds in timings.items():
+        registry.observe('casting_request_phase_seconds', seconds,
+                         route=route, phase=phase)
+    return total
+
+
+def end_request(response):
+    if 'request_started' not in g:
+        return response
+    observation = (route_label(), request.method, response.status_code,
+                   g.request_started, g.timings)
+    if response.is_streamed:
+        # the body (and its db and format time) is only produced after this
+        # hook: observe the request once it is sent, the timings dict is
+        # still filled in by the generator
+        response.call_on_close(lambda: observe_request(*observation))
+        total = time.perf_counter() - g.request_started
+    else:
+        total = observe_request(*observation)
+    if SERVER_TIMING:
+        response.headers['Server-Timing'] = ', '.join(
+            '{};dur={:.2f}'.format(phase, seconds * 1000)
+            for phase, seconds in list(g.timings.items()) + [('total', total)])
+    return response
+
+
+'''
+init_metrics(app, sources)
+    time every request of app and serve GET /metrics
+
+    sources maps a metric name to a (function, help text) pair, the
+    function returning a dict of numbers exported as gauges, i.e. the stats
+    of the token and response caches and of the connection pool. Metrics
+    are kept per worker process.
+'''
+
+
+def init_metrics(app, sources=None):
+    sources = sources or {}
+    app.before_request(start_request)
+    app.after_request(end_request)
+
+    @app.route('/metrics', methods=['GET'])
+    def metrics():
+        '''
+        metrics
+        receive get request, return the metrics of this worker in the
+        Prometheus text format
+        '''
+        if METRICS_TOKEN and request.headers.get(
+                'Authorization') != 'Bearer ' + METRICS_TOKEN:
+            return app.response_class(status=401)
+        lines = registry.exposition()
+        for name, (source, help_text) in sorted(sources.items()):
+            lines.extend(gauges(name, source(), help_text))
+        return app.response_class(
+            '\n'.join(lines) + '\n',
+            content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,43 @@
+"""create movies and actors
+
+Revision ID: 13dcc293c6d0
+Revises:
+Create Date: 2026-10-18 09:12:41.318734
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '13dcc293c6d0'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # databases set up by db.create_all() already have both tables
+    tables = sa.inspect(op.get_bind()).get_table_names()
+    if 'movies' not in tables:
+        op.create_table(
+            'movies',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('title', sa.String(), nullable=True),
+            sa.Column('release', sa.DateTime(), nullable=True),
+            sa.PrimaryKeyConstraint('id')
+        )
+    if 'actors' not in tables:
+        op.create_table(
+            'actors',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('name', sa.String(), nullable=True),
+            sa.Column('age', sa.Integer(), nullable=True),
+            sa.Column('gender', sa.String(), nullable=True),
+            sa.PrimaryKeyConstraint('id')
+        )
+
+
+def downgrade():
+    op.drop_table('actors')
+    op.drop_table('movies')
@@ -0,0 +1,34 @@
+"""add row versions
+
+Revision ID: 7d3a95e0c6b1
+Revises: c81f4d2a9b37
+Create Date: 2026-10-18 12:31:07.209114
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7d3a95e0c6b1'
+down_revision = 'c81f4d2a9b37'
+branch_labels = None
+depends_on = None
+
+TABLES = ['actors', 'movies']
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    for table in TABLES:
+        # db.create_all() creates the column on new databases
+        if 'version' in {c['name'] for c in inspector.get_columns(table)}:
+            continue
+        op.add_column(table, sa.Column(
+            'version', sa.Integer(), nullable=False, server_default='1'))
+
+
+def downgrade():
+    for table in reversed(TABLES):
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.drop_column('version')
@@ -0,0 +1,40 @@
+"""add table versions
+
+Revision ID: 9f1c2d7e4a85
+Revises: e4b8c2f1a07d
+Create Date: 2026-10-18 16:20:11.402517
+
+"""
+import uuid
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9f1c2d7e4a85'
+down_revision = 'e4b8c2f1a07d'
+branch_labels = None
+depends_on = None
+
+TABLES = ['actors', 'movies', 'movie_cast']
+
+
+def upgrade():
+    # db.create_all() creates and fills the table on new databases
+    if 'table_versions' in sa.inspect(op.get_bind()).get_table_names():
+        return
+    table_versions = op.create_table(
+        'table_versions',
+        sa.Column('name', sa.String(), nullable=False),
+        sa.Column('epoch', sa.String(length=32), nullable=False),
+        sa.Column('version', sa.Integer(), server_default='0',
+                  nullable=False),
+        sa.PrimaryKeyConstraint('name')
+    )
+    op.bulk_insert(table_versions, [
+        {'name': name, 'epoch': uuid.uuid4().hex, 'version': 0}
+        for name in TABLES])
+
+
+def downgrade():
+    op.drop_table('table_versions')
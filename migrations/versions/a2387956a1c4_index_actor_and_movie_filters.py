@@ -0,0 +1,41 @@
+"""index actor and movie filters
+
+Revision ID: a2387956a1c4
+Revises: 13dcc293c6d0
+Create Date: 2026-10-18 09:20:07.562210
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a2387956a1c4'
+down_revision = '13dcc293c6d0'
+branch_labels = None
+depends_on = None
+
+INDEXES = [
+    ('ix_actors_name', 'actors', 'name', True),
+    ('ix_actors_gender', 'actors', 'gender', False),
+    ('ix_actors_age', 'actors', 'age', False),
+    ('ix_movies_title', 'movies', 'title', True),
+    ('ix_movies_release', 'movies', 'release', False),
+]
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    for name, table, column, prefix_search in INDEXES:
+        # db.create_all() creates the indexes on new databases
+        if name in {index['name'] for index in inspector.get_indexes(table)}:
+            continue
+        options = {}
+        if prefix_search:
+            options['postgresql_ops'] = {column: 'text_pattern_ops'}
+        op.create_index(name, table, [column], **options)
+
+
+def downgrade():
+    for name, table, column, prefix_search in reversed(INDEXES):
+        op.drop_index(name, table_name=table)
@@ -0,0 +1,42 @@
+"""add search indexes
+
+Revision ID: c81f4d2a9b37
+Revises: 5e0b7c4f18d2
+Create Date: 2026-10-18 11:14:32.418530
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c81f4d2a9b37'
+down_revision = '5e0b7c4f18d2'
+branch_labels = None
+depends_on = None
+
+SEARCH_INDEXES = [
+    ('ix_actors_name_tsv', 'actors',
+     "to_tsvector('simple', coalesce(name, ''))"),
+    ('ix_actors_name_trgm', 'actors', 'name gin_trgm_ops'),
+    ('ix_movies_title_tsv', 'movies',
+     "to_tsvector('simple', coalesce(title, ''))"),
+    ('ix_movies_title_trgm', 'movies', 'title gin_trgm_ops'),
+]
+
+
+def upgrade():
+    # other databases search with the in-memory index of search.py
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    for name, table, expression in SEARCH_INDEXES:
+        op.execute('CREATE INDEX IF NOT EXISTS {} ON {} USING gin ({})'.format(
+            name, table, expression))
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    for name, table, expression in reversed(SEARCH_INDEXES):
+        op.execute('DROP INDEX IF EXISTS {}'.format(name))
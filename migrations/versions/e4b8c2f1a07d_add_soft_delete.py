@@ -0,0 +1,39 @@
+"""add soft delete
+
+Revision ID: e4b8c2f1a07d
+Revises: 7d3a95e0c6b1
+Create Date: 2026-10-18 13:05:44.730862
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e4b8c2f1a07d'
+down_revision = '7d3a95e0c6b1'
+branch_labels = None
+depends_on = None
+
+TABLES = ['actors', 'movies']
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    for table in TABLES:
+        # db.create_all() creates the column and index on new databases
+        if 'deleted_at' not in {
+                c['name'] for c in inspector.get_columns(table)}:
+            op.add_column(table, sa.Column('deleted_at', sa.DateTime()))
+        name = 'ix_{}_live_id'.format(table)
+        if name not in {i['name'] for i in inspector.get_indexes(table)}:
+            where = sa.text('deleted_at IS NULL')
+            op.create_index(name, table, ['id'], postgresql_where=where,
+                            sqlite_where=where)
+
+
+def downgrade():
+    for table in reversed(TABLES):
+        op.drop_index('ix_{}_live_id'.format(table), table_name=table)
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.drop_column('deleted_at')
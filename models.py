@@ -1,26 +1,176 @@
 import os
-from sqlalchemy import Column, String, Integer, DateTime
+import sqlite3
+import time
+import uuid
+from sqlalchemy import Column, String, Integer, DateTime, Index, event
+from sqlalchemy import DDL, ForeignKey, bindparam, func, select, text
+from sqlalchemy import exc
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import QueuePool
 from flask_sqlalchemy import SQLAlchemy
 import json
+from contextlib import contextmanager
+from functools import lru_cache
+from metrics import timed
+from profiler import DB_PROFILE, install_profiler
 
 # database_name = "casting_agency"
-DATABASE_URL = os.environ['DATABASE_URL']
-database_path = DATABASE_URL
+
+
+def env_flag(name, default):
+    return os.environ.get(name, default).lower() in ('1', 'true', 'yes')
+
+
+# connection pool of each worker, size it against the worker's concurrency:
+# the database sees up to workers * (DB_POOL_SIZE + DB_MAX_OVERFLOW)
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 5))
+DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 10))
+# seconds to wait for a free connection before failing the request
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 30))
+# seconds after which a connection is replaced, -1 keeps them forever
+DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', 1800))
+# test each connection on checkout, drops the ones a failover killed
+DB_POOL_PRE_PING = env_flag('DB_POOL_PRE_PING', 'true')
+# milliseconds a statement may run on Postgres, 0 means no limit
+DB_STATEMENT_TIMEOUT = int(os.environ.get('DB_STATEMENT_TIMEOUT', 0))
+# deletes set deleted_at instead of removing the row
+SOFT_DELETE = env_flag('SOFT_DELETE', 'false')
 
 db = SQLAlchemy()
 
+'''
+InstrumentedQueuePool
+    QueuePool recording connects, checkouts, invalidations and the time
+    spent waiting for a free connection into pool_stats
+'''
+
+pool_stats = {
+    'connects': 0,
+    'checkouts': 0,
+    'checkins': 0,
+    'invalidations': 0,
+    'timeouts': 0,
+    'wait_seconds_total': 0.0,
+    'wait_seconds_max': 0.0,
+}
+
+
+class InstrumentedQueuePool(QueuePool):
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            pool_stats['timeouts'] += 1
+            raise
+        finally:
+            waited = time.perf_counter() - started
+            pool_stats['wait_seconds_total'] += waited
+            pool_stats['wait_seconds_max'] = max(
+                pool_stats['wait_seconds_max'], waited)
+
+
+def count(name):
+    def listener(*args):
+        pool_stats[name] += 1
+    return listener
+
+
+event.listen(InstrumentedQueuePool, 'connect', count('connects'))
+event.listen(InstrumentedQueuePool, 'checkout', count('checkouts'))
+event.listen(InstrumentedQueuePool, 'checkin', count('checkins'))
+event.listen(InstrumentedQueuePool, 'invalidate', count('invalidations'))
+
+
+def pool_status():
+    '''
+    pool_stats plus the current state of the pool, in an app context
+    '''
+    status = dict(pool_stats)
+    pool = db.engine.pool
+    if isinstance(pool, QueuePool):
+        status.update({
+            'size': pool.size(),
+            'checked_out': pool.checkedout(),
+            'overflow': pool.overflow(),
+        })
+    return status
+
+
+@event.listens_for(Engine, 'connect')
+def enable_sqlite_foreign_keys(dbapi_connection, connection_record):
+    '''
+    SQLite ignores ON DELETE CASCADE unless foreign keys are switched on
+    '''
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA foreign_keys=ON')
+        cursor.close()
+
+
+'''
+engine_options(database_path, **overrides)
+    engine options of the connection pool, from the DB_* environment
+    variables, overrides take precedence. SQLite keeps the pool chosen by
+    Flask-SQLAlchemy.
+'''
+
+
+PSYCOPG2_SCHEMES = ('postgres', 'postgresql', 'postgresql+psycopg2')
+
+
+def engine_options(database_path, **overrides):
+    if database_path.startswith('sqlite'):
+        return dict(overrides)
+
+    options = {
+        'poolclass': InstrumentedQueuePool,
+        'pool_size': DB_POOL_SIZE,
+        'max_overflow': DB_MAX_OVERFLOW,
+        'pool_timeout': DB_POOL_TIMEOUT,
+        'pool_recycle': DB_POOL_RECYCLE,
+        'pool_pre_ping': DB_POOL_PRE_PING,
+    }
+    if DB_STATEMENT_TIMEOUT and database_path.startswith('postgres'):
+        options['connect_args'] = {
+            'options': '-c statement_timeout={}'.format(DB_STATEMENT_TIMEOUT)
+        }
+    if database_path.split('://')[0] in PSYCOPG2_SCHEMES:
+        # executemany (bulk updates) sent as pages of statements with
+        # execute_batch instead of one round trip per row
+        options['use_batch_mode'] = True
+    options.update(overrides)
+    return options
+
+
 '''
 setup_db(app)
     binds a flask application and a SQLAlchemy service
+    database_path defaults to the DATABASE_URL environment variable, read
+    when setup_db is called rather than when models is imported
+    pool_options override the engine options read from the environment
+    profile (DB_PROFILE by default) logs the slow requests and the
+    statements repeated within a request, see profiler.py
+    create_tables runs db.create_all() right away, otherwise nothing
+    connects to the database until the app uses it
 '''
 
 
-def setup_db(app, database_path=database_path):
+def setup_db(app, database_path=None, pool_options=None,
+             profile=DB_PROFILE, create_tables=True):
+    if database_path is None:
+        database_path = os.environ['DATABASE_URL']
     app.config["SQLALCHEMY_DATABASE_URI"] = database_path
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(
+        database_path, **(pool_options or {}))
     db.app = app
     db.init_app(app)
-    db.create_all()
+    if profile:
+        # creating the engine does not open a connection
+        install_profiler(app, db.get_engine(app))
+    if create_tables:
+        db.create_all()
 
 
 '''
@@ -41,10 +191,362 @@ def db_drop_and_create_all():
     actor1 = Actor(name="Robert Downey Jr.", age=54, gender="Male")
     actor2 = Actor(name="Shia LaBeouf", age=33, gender="Male")
 
-    movie1.insert()
-    movie2.insert()
-    actor1.insert()
-    actor2.insert()
+    with unit_of_work():
+        movie1.insert()
+        movie2.insert()
+        actor1.insert()
+        actor2.insert()
+
+
+'''
+table_versions, bump_versions(tables), read_versions(tables)
+    change version of each table, bumped by every write path in the same
+    transaction as the write, so every worker and every other process
+    (manage.py, an import) sees the new version as soon as the write
+    commits. The epoch of a row is drawn when the table is created, so the
+    versions of a recreated database never match the ones seen before.
+'''
+
+VERSIONED_TABLES = ('actors', 'movies', 'movie_cast')
+
+table_versions = db.Table(
+    'table_versions',
+    Column('name', String, primary_key=True),
+    Column('epoch', String(32), nullable=False),
+    Column('version', Integer, nullable=False, server_default='0'),
+)
+
+
+def initial_versions():
+    return [{'name': name, 'epoch': uuid.uuid4().hex, 'version': 0}
+            for name in VERSIONED_TABLES]
+
+
+@event.listens_for(table_versions, 'after_create')
+def insert_versions(target, connection, **kw):
+    connection.execute(target.insert(), initial_versions())
+
+
+def bump_versions(tables):
+    if not tables:
+        return
+    # rows are locked in name order, so two writers cannot deadlock
+    db.session.execute(
+        table_versions.update()
+        .where(table_versions.c.name.in_(sorted(tables)))
+        .values(version=table_versions.c.version + 1))
+
+
+def read_versions(tables):
+    '''
+    {table: 'epoch.version'} for each of tables, '0' for an unknown table
+    '''
+    rows = db.session.execute(
+        select([table_versions.c.name, table_versions.c.epoch,
+                table_versions.c.version])
+        .where(table_versions.c.name.in_(list(tables))))
+    versions = {name: '{}.{}'.format(epoch, version)
+                for name, epoch, version in rows}
+    return {table: versions.get(table, '0') for table in tables}
+
+
+'''
+unit_of_work()
+    context manager (or decorator) running the writes of its block in a
+    single transaction, committed once when the block ends
+
+    the model helpers (insert, update, delete and the row and bulk helpers)
+    commit through commit(): inside a unit of work they only flush, so ids
+    and constraint errors show up right away, and the versions of the
+    tables they wrote are bumped when the unit commits, in its transaction.
+    An exception rolls the whole unit back, without bumping any version. A
+    unit of work inside another one joins the outer transaction.
+'''
+
+
+@contextmanager
+def unit_of_work():
+    session = db.session()
+    if 'unit_of_work' in session.info:
+        yield
+        return
+    tables = session.info['unit_of_work'] = set()
+    try:
+        yield
+        bump_versions(tables)
+        session.commit()
+    except BaseException:
+        session.rollback()
+        raise
+    finally:
+        del session.info['unit_of_work']
+
+
+def commit(*tables):
+    '''
+    bump the versions of tables and commit the session, or leave both to
+    the active unit_of_work
+    '''
+    tables_written = db.session.info.get('unit_of_work')
+    if tables_written is None:
+        bump_versions(tables)
+        db.session.commit()
+    else:
+        db.session.flush()
+        tables_written.update(tables)
+
+
+'''
+bulk_insert(model, rows), bulk_update(model, rows), bulk_delete(model, ids)
+    write many rows of a model in a single transaction, without building
+    ORM objects
+
+    bulk_insert sets the new primary key in each row dict and returns the
+    ids in order, bulk_update and bulk_delete return the set of ids that
+    existed and were written
+
+    on Postgres bulk_insert sends multi-row INSERT ... RETURNING id
+    statements of INSERT_CHUNK_SIZE rows, elsewhere one executemany INSERT
+    whose ids are read back from the highest id once it is written
+'''
+
+# ids per IN (...) clause, stays below the bind parameter limits
+IN_CHUNK_SIZE = 500
+# rows per multi-row INSERT
+INSERT_CHUNK_SIZE = 1000
+
+
+def existing_ids(model, ids):
+    found = set()
+    ids = list(ids)
+    for start in range(0, len(ids), IN_CHUNK_SIZE):
+        chunk = ids[start:start + IN_CHUNK_SIZE]
+        found.update(row[0] for row in db.session.query(model.id).filter(
+            model.id.in_(chunk), not_deleted(model)))
+    return found
+
+
+def row_exists(model, id):
+    return db.session.query(model.id).filter(
+        model.id == id, not_deleted(model)).scalar() is not None
+
+
+def same_columns(rows):
+    '''
+    the rows with every column given in any of them, missing ones as NULL
+    '''
+    names = set(name for row in rows for name in row)
+    return [{name: row.get(name) for name in names} for row in rows]
+
+
+def insert_statements(table, rows):
+    '''
+    multi-row INSERT statements returning the new ids, one per chunk of rows
+    '''
+    for start in range(0, len(rows), INSERT_CHUNK_SIZE):
+        yield table.insert().values(
+            rows[start:start + INSERT_CHUNK_SIZE]).returning(table.c.id)
+
+
+def bulk_insert(model, rows):
+    table = model.__table__
+    values = same_columns(rows)
+    ids = []
+    if values and db.engine.dialect.name == 'postgresql':
+        for statement in insert_statements(table, values):
+            # the serial ids of one statement are drawn in VALUES order
+            ids.extend(sorted(
+                id for id, in db.session.execute(statement)))
+    elif values:
+        db.session.execute(table.insert(), values)
+        # the transaction holds the write lock: the rows got the last ids
+        last = db.session.query(func.max(model.id)).scalar()
+        ids = list(range(last - len(rows) + 1, last + 1))
+    for row, id in zip(rows, ids):
+        row['id'] = id
+    commit(model.__tablename__)
+    return ids
+
+
+def bulk_update(model, rows):
+    found = existing_ids(model, set(row['id'] for row in rows))
+    table = model.__table__
+    # one executemany UPDATE per set of written columns
+    groups = {}
+    for row in rows:
+        if row['id'] in found:
+            columns = tuple(sorted(key for key in row if key != 'id'))
+            groups.setdefault(columns, []).append(row)
+    for columns, group in groups.items():
+        statement = table.update().where(
+            table.c.id == bindparam('row_id')
+        ).values(version=table.c.version + 1,
+                 **{column: bindparam(column) for column in columns})
+        db.session.execute(statement, [
+            dict({column: row[column] for column in columns},
+                 row_id=row['id'])
+            for row in group
+        ])
+    commit(model.__tablename__)
+    return found
+
+
+'''
+update_row(model, id, values, versions)
+    update the given columns of one row in a single UPDATE, incrementing
+    its version, and return the formatted row, None when no row matched
+
+    with versions, the row is only updated while its version is one of
+    them (optimistic concurrency). On Postgres RETURNING sends back the new
+    row in the same statement, other backends read it back in the
+    transaction.
+'''
+
+
+def update_row(model, id, values, versions=None):
+    table = model.__table__
+    condition = (table.c.id == id) & table.c.deleted_at.is_(None)
+    if versions is not None:
+        condition = condition & table.c.version.in_(versions)
+    statement = table.update().where(condition).values(
+        version=table.c.version + 1, **values)
+    columns = model.rows().statement.columns
+
+    if db.engine.dialect.name == 'postgresql':
+        row = db.session.execute(statement.returning(*columns)).first()
+    else:
+        result = db.session.execute(statement)
+        row = None
+        if result.rowcount:
+            row = model.rows().filter(model.id == id).first()
+    if row is None:
+        commit()
+        return None
+    commit(model.__tablename__)
+    return model.format_rows([row])[0]
+
+
+def bulk_delete(model, ids, soft=None):
+    found = list(existing_ids(model, set(ids)))
+    for start in range(0, len(found), IN_CHUNK_SIZE):
+        db.session.execute(delete_statement(
+            model, model.id.in_(found[start:start + IN_CHUNK_SIZE]), soft))
+    commit(model.__tablename__)
+    return set(found)
+
+
+'''
+delete_row(model, id, soft), not_deleted(model)
+    delete one row in a single statement, returning whether it existed
+
+    with soft (SOFT_DELETE by default) the row is kept as a tombstone: its
+    deleted_at is set and its version incremented. Every read filters
+    tombstones out with not_deleted(model), backed by a partial index of
+    the live ids.
+'''
+
+
+def not_deleted(model):
+    return model.deleted_at.is_(None)
+
+
+def delete_statement(model, condition, soft=None):
+    table = model.__table__
+    condition = condition & table.c.deleted_at.is_(None)
+    if SOFT_DELETE if soft is None else soft:
+        return table.update().where(condition).values(
+            deleted_at=func.now(), version=table.c.version + 1)
+    return table.delete().where(condition)
+
+
+def delete_row(model, id, soft=None):
+    result = db.session.execute(delete_statement(model, model.id == id, soft))
+    if not result.rowcount:
+        commit()
+        return False
+    commit(model.__tablename__)
+    return True
+
+
+def delete_object(obj):
+    '''
+    delete_row for an object of the session, a tombstone with SOFT_DELETE
+    '''
+    # pending changes to the object are written before its row goes away
+    db.session.flush()
+    id = obj.id
+    if SOFT_DELETE:
+        delete_row(type(obj), id, soft=True)
+        db.session.expire(obj)
+    else:
+        # like session.delete, the object keeps its last state, detached
+        db.session.expunge(obj)
+        delete_row(type(obj), id, soft=False)
+
+
+'''
+movie_cast
+    the actors cast in each movie, rows go away with their movie or actor
+
+add_cast(movie_id, actor_ids), remove_cast(movie_id, actor_id)
+    cast actors in a movie, returning the ids that were not cast yet, or
+    remove one of them, returning the number of rows deleted
+'''
+
+movie_cast = db.Table(
+    'movie_cast',
+    Column('movie_id', Integer,
+           ForeignKey('movies.id', ondelete='CASCADE'), primary_key=True),
+    Column('actor_id', Integer,
+           ForeignKey('actors.id', ondelete='CASCADE'), primary_key=True),
+    Index('ix_movie_cast_actor_id', 'actor_id'),
+)
+
+
+def add_cast(movie_id, actor_ids):
+    actor_ids = list(dict.fromkeys(actor_ids))
+    cast = set(row[0] for row in db.session.query(
+        movie_cast.c.actor_id
+    ).filter(
+        movie_cast.c.movie_id == movie_id,
+        movie_cast.c.actor_id.in_(actor_ids)))
+    new_ids = [actor_id for actor_id in actor_ids if actor_id not in cast]
+    if new_ids:
+        db.session.execute(movie_cast.insert(), [
+            {'movie_id': movie_id, 'actor_id': actor_id}
+            for actor_id in new_ids
+        ])
+    commit('movie_cast')
+    return new_ids
+
+
+def remove_cast(movie_id, actor_id):
+    result = db.session.execute(movie_cast.delete().where(
+        (movie_cast.c.movie_id == movie_id) &
+        (movie_cast.c.actor_id == actor_id)))
+    commit('movie_cast')
+    return result.rowcount
+
+
+'''
+format_release(release)
+    release dates are shared by many movies, so their formatting is memoized
+'''
+
+
+@lru_cache(maxsize=4096)
+def format_release(release):
+    if release is None:
+        return None
+    return release.strftime("%Y %B %d")
+
+
+'''
+Model.rows() and Model.format_rows(rows)
+    fast path for listings: rows() selects the formatted columns as plain
+    tuples, skipping ORM object construction and the identity map, and
+    format_rows() turns them into the same dicts as format() in a tight loop
+'''
 
 
 class Movie(db.Model):
@@ -52,9 +554,38 @@ class Movie(db.Model):
     Movie class
     '''
     __tablename__ = 'movies'
+    # text_pattern_ops lets Postgres use the index for prefix LIKE in any
+    # collation
+    __table_args__ = (
+        Index('ix_movies_title', 'title',
+              postgresql_ops={'title': 'text_pattern_ops'}),
+        Index('ix_movies_release', 'release'),
+        # live ids in order, for the listings once rows are soft deleted
+        Index('ix_movies_live_id', 'id',
+              postgresql_where=text('deleted_at IS NULL'),
+              sqlite_where=text('deleted_at IS NULL')),
+    )
     id = Column(Integer, primary_key=True)
     title = Column(String)
     release = Column(DateTime)
+    # incremented by every update, compared with If-Match
+    version = Column(Integer, nullable=False, default=1, server_default='1')
+    # set when the movie is soft deleted
+    deleted_at = Column(DateTime)
+    # loaded on access, list endpoints embedding the cast use selectinload,
+    # soft deleted actors and movies are left out of the casts
+    actors = db.relationship(
+        'Actor', secondary=movie_cast, order_by='Actor.id',
+        primaryjoin='Movie.id == movie_cast.c.movie_id',
+        secondaryjoin='and_(Actor.id == movie_cast.c.actor_id, '
+                      'Actor.deleted_at.is_(None))',
+        passive_deletes=True,
+        backref=db.backref(
+            'movies', order_by='Movie.id',
+            primaryjoin='Actor.id == movie_cast.c.actor_id',
+            secondaryjoin='and_(Movie.id == movie_cast.c.movie_id, '
+                          'Movie.deleted_at.is_(None))',
+            passive_deletes=True))
 
     def __init__(self, title, release):
         self.title = title
@@ -62,32 +593,59 @@ class Movie(db.Model):
 
     def insert(self):
         db.session.add(self)
-        db.session.commit()
+        commit(self.__tablename__)
 
-    def update(sefl):
-        db.session.commit()
+    def update(self):
+        self.version = type(self).version + 1
+        commit(self.__tablename__)
 
     def delete(self):
-        db.session.delete(self)
-        db.session.commit()
+        delete_object(self)
 
     def format(self):
         return {
             'id': self.id,
             'title': self.title,
-            'release': self.release.strftime("%Y %B %d"),
+            'release': format_release(self.release),
+            'version': self.version,
         }
 
+    @staticmethod
+    def rows():
+        return db.session.query(
+            Movie.id, Movie.title, Movie.release, Movie.version
+        ).filter(not_deleted(Movie))
+
+    @staticmethod
+    def format_rows(rows):
+        with timed('format'):
+            return [
+                {'id': id, 'title': title,
+                 'release': format_release(release), 'version': version}
+                for id, title, release, version in rows
+            ]
+
 
 class Actor(db.Model):
     '''
     Actor class
     '''
     __tablename__ = 'actors'
+    __table_args__ = (
+        Index('ix_actors_name', 'name',
+              postgresql_ops={'name': 'text_pattern_ops'}),
+        Index('ix_actors_gender', 'gender'),
+        Index('ix_actors_age', 'age'),
+        Index('ix_actors_live_id', 'id',
+              postgresql_where=text('deleted_at IS NULL'),
+              sqlite_where=text('deleted_at IS NULL')),
+    )
     id = Column(Integer, primary_key=True)
     name = Column(String)
     age = Column(Integer)
     gender = Column(String)
+    version = Column(Integer, nullable=False, default=1, server_default='1')
+    deleted_at = Column(DateTime)
 
     def __init__(self, name, age, gender):
         self.name = name
@@ -96,14 +654,14 @@ class Actor(db.Model):
 
     def insert(self):
         db.session.add(self)
-        db.session.commit()
+        commit(self.__tablename__)
 
-    def update(sefl):
-        db.session.commit()
+    def update(self):
+        self.version = type(self).version + 1
+        commit(self.__tablename__)
 
     def delete(self):
-        db.session.delete(self)
-        db.session.commit()
+        delete_object(self)
 
     def format(self):
         return {
@@ -111,4 +669,51 @@ class Actor(db.Model):
             'name': self.name,
             'age': self.age,
             'gender': self.gender,
+            'version': self.version,
         }
+
+    @staticmethod
+    def rows():
+        return db.session.query(
+            Actor.id, Actor.name, Actor.age, Actor.gender, Actor.version
+        ).filter(not_deleted(Actor))
+
+    @staticmethod
+    def format_rows(rows):
+        with timed('format'):
+            return [
+                {'id': id, 'name': name, 'age': age, 'gender': gender,
+                 'version': version}
+                for id, name, age, gender, version in rows
+            ]
+
+
+'''
+search indexes
+    on Postgres, the name of actors and the title of movies get a GIN index
+    over their `simple` tsvector for full-text matches and a GIN trigram
+    index (pg_trgm) for fuzzy matches, both used by search.py. They are
+    expression indexes, so writes need no extra column to keep in sync.
+    Other databases get neither, search.py falls back to an in-memory index.
+'''
+
+SEARCH_COLUMNS = [('actors', 'name'), ('movies', 'title')]
+
+
+def search_index_ddl(table, column):
+    return [
+        "CREATE INDEX IF NOT EXISTS ix_{0}_{1}_tsv ON {0} USING gin "
+        "(to_tsvector('simple', coalesce({1}, '')))".format(table, column),
+        "CREATE INDEX IF NOT EXISTS ix_{0}_{1}_trgm ON {0} USING gin "
+        "({1} gin_trgm_ops)".format(table, column),
+    ]
+
+
+event.listen(db.metadata, 'before_create', DDL(
+    'CREATE EXTENSION IF NOT EXISTS pg_trgm'
+).execute_if(dialect='postgresql'))
+
+for table, column in SEARCH_COLUMNS:
+    for statement in search_index_ddl(table, column):
+        event.listen(db.metadata.tables[table], 'after_create',
+                     DDL(statement).execute_if(dialect='postgresql'))
@@ -0,0 +1,107 @@
+import logging
+import os
+import time
+from collections import Counter
+from flask import g, has_request_context, request
+from sqlalchemy import event
+
+# profile the statements of every request, meant for development and tests
+DB_PROFILE = os.environ.get('DB_PROFILE', 'false').lower() in (
+    '1', 'true', 'yes')
+# a request spending more milliseconds than this in the database is logged
+DB_PROFILE_SLOW_MS = float(os.environ.get('DB_PROFILE_SLOW_MS', 100))
+# a request sending more statements than this is logged
+DB_PROFILE_MAX_STATEMENTS = int(
+    os.environ.get('DB_PROFILE_MAX_STATEMENTS', 20))
+# an identical statement sent this many times in a request is an N+1
+DB_PROFILE_REPEATS = int(os.environ.get('DB_PROFILE_REPEATS', 5))
+# number of slowest statements reported for a logged request
+DB_PROFILE_SLOWEST = int(os.environ.get('DB_PROFILE_SLOWEST', 3))
+
+logger = logging.getLogger(__name__)
+
+'''
+RequestProfile
+    the statements sent during one request, with their duration
+
+    statements are compared on their SQL text, which holds placeholders
+    instead of the parameters, so the same lookup done once per row of a
+    listing counts as one statement repeated
+'''
+
+
+class RequestProfile:
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.statements = []
+        self.repeats = Counter()
+
+    def record(self, statement, seconds):
+        self.count += 1
+        self.seconds += seconds
+        self.statements.append((seconds, statement))
+        self.repeats[statement] += 1
+
+    def slowest(self, n=DB_PROFILE_SLOWEST):
+        return sorted(self.statements, key=lambda item: -item[0])[:n]
+
+    def repeated(self, threshold=DB_PROFILE_REPEATS):
+        return [(statement, count)
+                for statement, count in self.repeats.most_common()
+                if count >= threshold]
+
+
+def shorten(statement, length=200):
+    statement = ' '.join(statement.split())
+    if len(statement) > length:
+        return statement[:length] + '...'
+    return statement
+
+
+def report(profile):
+    '''
+    log the request when it is slow, chatty or repeats a statement
+    '''
+    label = '{} {}'.format(request.method, request.path)
+    if profile.seconds * 1000 > DB_PROFILE_SLOW_MS or \
+            profile.count > DB_PROFILE_MAX_STATEMENTS:
+        logger.warning(
+            '%s: %d statements, %.1f ms in the database, slowest: %s',
+            label, profile.count, profile.seconds * 1000,
+            '; '.join('{:.1f} ms {}'.format(seconds * 1000, shorten(sql))
+                      for seconds, sql in profile.slowest()))
+    for statement, count in profile.repeated():
+        logger.warning('%s: possible N+1, statement sent %d times: %s',
+                       label, count, shorten(statement))
+
+
+'''
+install_profiler(app, engine)
+    profile the statements engine runs during each request of app, the
+    profile of the current request is g.query_profile
+'''
+
+
+def install_profiler(app, engine):
+    @event.listens_for(engine, 'before_cursor_execute')
+    def start_statement(conn, cursor, statement, parameters, context,
+                        executemany):
+        conn.info['profile_started'] = time.perf_counter()
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def end_statement(conn, cursor, statement, parameters, context,
+                      executemany):
+        if has_request_context() and 'query_profile' in g:
+            g.query_profile.record(
+                statement,
+                time.perf_counter() - conn.info['profile_started'])
+
+    @app.before_request
+    def start_profile():
+        g.query_profile = RequestProfile()
+
+    @app.teardown_request
+    def end_profile(error):
+        if 'query_profile' in g:
+            report(g.query_profile)
@@ -0,0 +1,166 @@
+import re
+import threading
+from sqlalchemy import func, literal, literal_column, union_all
+from cache import request_versions
+from models import db, Actor, Movie, not_deleted
+
+# pg_trgm's default threshold of the % operator
+SIMILARITY_THRESHOLD = 0.3
+
+'''
+search
+    ranked search over the name of actors and the title of movies
+
+    a row matches when it contains every word of q (full-text match) or
+    when its trigram similarity with q reaches SIMILARITY_THRESHOLD (fuzzy
+    match). Full-text matches come first, then rows by decreasing
+    similarity. Postgres answers from the indexes created in models.py,
+    other databases from a TrigramIndex rebuilt whenever the tables change.
+'''
+
+
+def words(text):
+    # like pg_trgm, anything but letters and digits separates words
+    return re.findall(r'[^\W_]+', (text or '').lower())
+
+
+def trigrams(text):
+    '''
+    the trigrams of text as pg_trgm computes them, each word padded with
+    two spaces in front and one behind
+    '''
+    grams = set()
+    for word in words(text):
+        padded = '  ' + word + ' '
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+def similarity(grams, other):
+    shared = len(grams & other)
+    if not shared:
+        return 0.0
+    return shared / (len(grams) + len(other) - shared)
+
+
+'''
+TrigramIndex(documents)
+    in-memory stand-in for the Postgres indexes, built from (key, text)
+    pairs. search(q) returns the (key, full_text_match, score) of the
+    matching documents, best first, with the same rules as Postgres.
+'''
+
+
+class TrigramIndex:
+    def __init__(self, documents):
+        self._documents = []
+        self._postings = {}
+        for key, text in documents:
+            grams = trigrams(text)
+            position = len(self._documents)
+            self._documents.append((key, grams, set(words(text))))
+            for gram in grams:
+                self._postings.setdefault(gram, []).append(position)
+
+    def __len__(self):
+        return len(self._documents)
+
+    def search(self, q, threshold=SIMILARITY_THRESHOLD):
+        query_grams = trigrams(q)
+        query_words = set(words(q))
+        # only documents sharing a trigram with q can match
+        candidates = set()
+        for gram in query_grams:
+            candidates.update(self._postings.get(gram, ()))
+
+        matches = []
+        for position in candidates:
+            key, grams, document_words = self._documents[position]
+            full_text = bool(query_words) and query_words <= document_words
+            score = similarity(query_grams, grams)
+            if full_text or score >= threshold:
+                matches.append((key, full_text, score))
+        matches.sort(key=lambda match: (not match[1], -match[2], match[0]))
+        return matches
+
+
+_fallback = {'versions': None, 'index': None}
+_fallback_lock = threading.Lock()
+
+
+def fallback_index():
+    '''
+    the TrigramIndex of every actor and movie, rebuilt after a write
+    '''
+    # versions are read before the rows, as in cache.cached_response
+    versions = request_versions(('actors', 'movies'))
+    with _fallback_lock:
+        if _fallback['versions'] != versions:
+            documents = [(('actor', id), name) for id, name in
+                         db.session.query(Actor.id, Actor.name).filter(
+                             not_deleted(Actor))]
+            documents += [(('movie', id), title) for id, title in
+                          db.session.query(Movie.id, Movie.title).filter(
+                              not_deleted(Movie))]
+            _fallback['index'] = TrigramIndex(documents)
+            _fallback['versions'] = versions
+        return _fallback['index']
+
+
+def fallback_matches(q, offset, limit):
+    return [(kind, id, full_text, score) for (kind, id), full_text, score
+            in fallback_index().search(q)[offset:offset + limit]]
+
+
+def postgres_matches(q, offset, limit):
+    config = literal_column("'simple'")
+
+    def matches(model, column, kind):
+        # same expression as the tsv index, or the planner cannot use it
+        document = func.to_tsvector(config, func.coalesce(column, ''))
+        full_text = document.op('@@')(func.plainto_tsquery(config, q))
+        # text % text is pg_trgm's similarity operator, written with the
+        # mod operator so the DBAPI escapes it like any other %
+        fuzzy = column % q
+        return db.session.query(
+            literal(kind).label('kind'),
+            model.id.label('id'),
+            full_text.label('full_text'),
+            func.similarity(column, q).label('score'),
+        ).filter(full_text | fuzzy, not_deleted(model)).statement
+
+    ranked = union_all(
+        matches(Actor, Actor.name, 'actor'),
+        matches(Movie, Movie.title, 'movie'),
+    ).alias('ranked')
+    return db.session.query(ranked).order_by(
+        ranked.c.full_text.desc(), ranked.c.score.desc(),
+        ranked.c.kind, ranked.c.id,
+    ).offset(offset).limit(limit).all()
+
+
+def search(q, offset, limit):
+    '''
+    return up to limit results after offset, each with its type, score and
+    the formatted actor or movie
+    '''
+    if db.engine.dialect.name == 'postgresql':
+        matches = postgres_matches(q, offset, limit)
+    else:
+        matches = fallback_matches(q, offset, limit)
+
+    ids = {'actor': [], 'movie': []}
+    for kind, id, full_text, score in matches:
+        ids[kind].append(id)
+    items = {}
+    for kind, model in (('actor', Actor), ('movie', Movie)):
+        if ids[kind]:
+            rows = model.rows().filter(model.id.in_(ids[kind]))
+            for item in model.format_rows(rows):
+                items[kind, item['id']] = item
+
+    # a row deleted between both queries is left out
+    return [
+        {'type': kind, 'score': round(score, 4), kind: items[kind, id]}
+        for kind, id, full_text, score in matches if (kind, id) in items
+    ]
@@ -1,9 +1,22 @@
 import os
+import shutil
+import tempfile
 import unittest
 import json
+from datetime import datetime
 from flask_sqlalchemy import SQLAlchemy
-from api import app
-from models import setup_db, Movie, Actor, db_drop_and_create_all
+from sqlalchemy import event
+import auth
+from api import create_app, filter_actors, filter_movies
+from models import Movie, Actor, db_drop_and_create_all, db
+from models import add_cast, bulk_insert, delete_row
+from tokens import ROLES, mint_token, public_pem
+
+database_name = "casting_test"
+database_path = "postgresql://{}/{}".format('localhost:5432', database_name)
+app = create_app({"SQLALCHEMY_DATABASE_URI": database_path})
+# accept the tokens minted by tokens.py instead of asking Auth0
+auth.key_provider = auth.PEMKey(public_pem())
 
 
 class TriviaTestCase(unittest.TestCase):
@@ -13,14 +26,13 @@ class TriviaTestCase(unittest.TestCase):
         """Define test variables and initialize app."""
         self.app = app
         self.client = self.app.test_client
-        self.database_name = "casting_test"
-        self.database_path = "postgresql://{}/{}".format(
-            'localhost:5432', self.database_name)
-        setup_db(self.app, self.database_path)
-        db_drop_and_create_all()
-        self.assistant_header = os.environ['AS_HEAD']
-        self.director_header = os.environ['DR_HEAD']
-        self.producer_header = os.environ['PR_HEAD']
+        self.database_name = database_name
+        self.database_path = database_path
+        with self.app.app_context():
+            db_drop_and_create_all()
+        self.assistant_header = mint_token(ROLES['assistant'])
+        self.director_header = mint_token(ROLES['director'])
+        self.producer_header = mint_token(ROLES['producer'])
         # binds the app to the current context
         with self.app.app_context():
             self.db = SQLAlchemy()
@@ -32,6 +44,22 @@ class TriviaTestCase(unittest.TestCase):
         """Executed after each test"""
         pass
 
+    def explain(self, url, query):
+        '''
+        Postgres plan of a listing query built for url, with sequential
+        scans disabled so an index is used whenever one applies
+        '''
+        with self.app.test_request_context(url):
+            statement = query().statement.compile(
+                dialect=db.engine.dialect,
+                compile_kwargs={"literal_binds": True})
+            db.session.execute("SET enable_seqscan = off")
+            plan = "\n".join(
+                row[0] for row in db.session.execute(
+                    "EXPLAIN " + str(statement)))
+            db.session.rollback()
+        return plan
+
     """
     Tests
     """
@@ -63,6 +91,183 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data['success'], True)
         self.assertTrue(data['movies'])
         self.assertTrue(len(data['movies']))
+
+    def test_get_actors_paginated(self):
+        '''
+        test get /actors one page at a time
+        '''
+        res = self.client().get(
+            '/actors?limit=1', headers={"Authorization": self.assistant_header})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(data['actors']), 1)
+        self.assertEqual(data['next_cursor'], data['actors'][0]['id'])
+        self.assertNotIn('total', data)
+
+        res = self.client().get(
+            '/actors?limit=1&cursor={}'.format(data['next_cursor']),
+            headers={"Authorization": self.assistant_header})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(data['actors']), 1)
+        self.assertEqual(data['next_cursor'], None)
+
+    def test_get_movies_total(self):
+        '''
+        test get /movies with the total count
+        '''
+        res = self.client().get(
+            '/movies?include_total=true',
+            headers={"Authorization": self.assistant_header})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['total'], 2)
+        self.assertEqual(data['next_cursor'], None)
+
+    def test_export_actors_ndjson(self):
+        '''
+        test get /actors/export one actor per line
+        '''
+        res = self.client().get(
+            '/actors/export', headers={"Authorization": self.assistant_header})
+        lines = res.data.decode().splitlines()
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.mimetype, 'application/x-ndjson')
+        self.assertEqual(len(lines), 2)
+        self.assertEqual(json.loads(lines[0])['id'], 1)
+
+    def test_export_movies_json(self):
+        '''
+        test get /movies/export as a single json document
+        '''
+        res = self.client().get(
+            '/movies/export?format=json',
+            headers={"Authorization": self.assistant_header})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(len(data['movies']), 2)
+
+    def test_get_actors_after_write(self):
+        '''
+        test get /actors is not served from cache after a new actor
+        '''
+        self.client().get(
+            '/actors', headers={"Authorization": self.assistant_header})
+        self.client().post(
+            '/actors', json={"name": "A", "age": 1, "gender": "m"},
+            headers={"Authorization": self.producer_header})
+        res = self.client().get(
+            '/actors', headers={"Authorization": self.assistant_header})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(data['actors']), 3)
+
+    def test_get_movies_not_modified(self):
+        '''
+        test get /movies with the ETag of the previous response
+        '''
+        res = self.client().get(
+            '/movies', headers={"Authorization": self.assistant_header})
+        etag = res.headers['ETag']
+
+        res = self.client().get(
+            '/movies', headers={"Authorization": self.assistant_header,
+                                "If-None-Match": etag})
+        self.assertEqual(res.status_code, 304)
+        self.assertEqual(res.data, b'')
+
+        self.client().post(
+            '/movies', json={"title": "A", "release": "2000-01-01"},
+            headers={"Authorization": self.producer_header})
+        res = self.client().get(
+            '/movies', headers={"Authorization": self.assistant_header,
+                                "If-None-Match": etag})
+        self.assertEqual(res.status_code, 200)
+        self.assertNotEqual(res.headers['ETag'], etag)
+
+    def test_get_actors_filtered(self):
+        '''
+        test get /actors with name prefix, gender and age filters
+        '''
+        res = self.client().get(
+            '/actors?name_prefix=Rob&gender=Male&age_min=50&age_max=60',
+            headers={"Authorization": self.assistant_header})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(
+            [a['name'] for a in data['actors']], ["Robert Downey Jr."])
+
+    def test_get_movies_filtered(self):
+        '''
+        test get /movies released after a date
+        '''
+        res = self.client().get(
+            '/movies?released_after=2008-01-01',
+            headers={"Authorization": self.assistant_header})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual([m['title'] for m in data['movies']], ["Iron Man"])
+
+    def test_get_actors_bad_filter(self):
+        '''
+        test get /actors with a malformed age filter
+        '''
+        res = self.client().get(
+            '/actors?age_min=old',
+            headers={"Authorization": self.assistant_header})
+
+        self.assertEqual(res.status_code, 422)
+
+    def test_filters_use_indexes(self):
+        '''
+        test every filter is planned as an index scan
+        '''
+        plans = {
+            "ix_actors_name": self.explain(
+                '/actors?name_prefix=Rob',
+                lambda: filter_actors(Actor.rows())),
+            "ix_actors_gender": self.explain(
+                '/actors?gender=Male', lambda: filter_actors(Actor.rows())),
+            "ix_actors_age": self.explain(
+                '/actors?age_min=30', lambda: filter_actors(Actor.rows())),
+            "ix_movies_title": self.explain(
+                '/movies?title_prefix=Iron',
+                lambda: filter_movies(Movie.rows())),
+            "ix_movies_release": self.explain(
+                '/movies?released_after=2008-01-01',
+                lambda: filter_movies(Movie.rows())),
+        }
+        for index, plan in plans.items():
+            self.assertIn(index, plan)
+
+    def test_get_actors_bad_limit(self):
+        '''
+        test get /actors with a limit out of range
+        '''
+        res = self.client().get(
+            '/actors?limit=0', headers={"Authorization": self.assistant_header})
+
+        self.assertEqual(res.status_code, 422)
+
+    def test_get_movies_malformed_page(self):
+        '''
+        test get /movies with a cursor or a limit that is not an integer
+        '''
+        for query in ('cursor=abc', 'limit=x'):
+            res = self.client().get(
+                '/movies?' + query,
+                headers={"Authorization": self.assistant_header})
+
+            self.assertEqual(res.status_code, 422)
     ##
 
     def test_post_actor_unauth(self):
@@ -103,6 +308,21 @@ class TriviaTestCase(unittest.TestCase):
         # print(data)
 
         self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['actor']['id'], data['new_actor_id'])
+        self.assertNotIn('actors', data)
+
+    def test_post_actor_include_list(self):
+        '''
+        test post /actors returning the list of all actors
+        '''
+        res = self.client().post(
+            '/actors?include_list=true', json={
+                "name": "A", "age": 1, "gender": "m"
+            }, headers={"Authorization": self.producer_header})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(data['actors']), 3)
 
     def test_post_movie(self):
         '''
@@ -171,6 +391,63 @@ class TriviaTestCase(unittest.TestCase):
 
         self.assertEqual(res.status_code, 200)
 
+    def test_patch_actor_if_match(self):
+        '''
+        test patch /actors/2 with a current then an outdated version
+        '''
+        headers = {"Authorization": self.producer_header, "If-Match": '"1"'}
+        res = self.client().patch(
+            '/actors/2', json={"age": 34}, headers=headers)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['actor']['age'], 34)
+        self.assertEqual(data['actor']['version'], 2)
+        self.assertEqual(res.headers['ETag'], '"2"')
+
+        res = self.client().patch(
+            '/actors/2', json={"age": 35}, headers=headers)
+        self.assertEqual(res.status_code, 412)
+
+    def test_patch_movie_missing(self):
+        '''
+        test patch /movies/1000 which does not exist
+        '''
+        res = self.client().patch(
+            '/movies/1000', json={"title": "B"},
+            headers={"Authorization": self.producer_header})
+
+        self.assertEqual(res.status_code, 404)
+
+    def test_patch_without_fields(self):
+        '''
+        test patch /actors/2 and /movies/2 with no field to update
+        '''
+        for path, body in (('/actors/2', {"name": None}),
+                           ('/movies/2', {"foo": 1})):
+            res = self.client().patch(
+                path, json=body,
+                headers={"Authorization": self.producer_header})
+
+            self.assertEqual(res.status_code, 422)
+        res = self.client().get(
+            '/actors', headers={"Authorization": self.producer_header})
+        self.assertTrue(all(actor['version'] == 1
+                            for actor in json.loads(res.data)['actors']))
+
+    def test_patch_malformed_fields(self):
+        '''
+        test patch /actors/2 and /movies/2 with values of the wrong type
+        '''
+        for path, body in (('/actors/2', {"age": "old"}),
+                           ('/actors/2', {"name": ""}),
+                           ('/movies/2', {"release": "someday"})):
+            res = self.client().patch(
+                path, json=body,
+                headers={"Authorization": self.producer_header})
+
+            self.assertEqual(res.status_code, 422)
+
     ##
     def test_delete_actor_unauth(self):
         '''
@@ -216,6 +493,302 @@ class TriviaTestCase(unittest.TestCase):
 
         self.assertEqual(res.status_code, 200)
 
+    def test_delete_actor_twice(self):
+        '''
+        test delete /actors/1 once it is already deleted
+        '''
+        self.client().delete(
+            '/actors/1', headers={"Authorization": self.producer_header})
+        res = self.client().delete(
+            '/actors/1', headers={"Authorization": self.producer_header})
+
+        self.assertEqual(res.status_code, 404)
+
+    def test_soft_delete_actor(self):
+        '''
+        test a soft deleted actor is kept but no longer listed
+        '''
+        with self.app.app_context():
+            self.assertTrue(delete_row(Actor, 1, soft=True))
+            self.assertFalse(delete_row(Actor, 1, soft=True))
+            self.assertIsNotNone(Actor.query.get(1).deleted_at)
+
+        res = self.client().get(
+            '/actors', headers={"Authorization": self.assistant_header})
+        data = json.loads(res.data)
+        self.assertEqual([a['id'] for a in data['actors']], [2])
+
+    ##
+    def test_post_actors_bulk(self):
+        '''
+        test post /actors/bulk with valid and invalid items
+        '''
+        res = self.client().post(
+            '/actors/bulk', json=[
+                {"name": "A", "age": 1, "gender": "m"},
+                {"age": 2},
+                {"name": "B"}
+            ], headers={"Authorization": self.producer_header})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['created'], 2)
+        self.assertEqual(
+            [r['status'] for r in data['results']], [201, 422, 201])
+        self.assertTrue(data['results'][2]['id'])
+
+    def test_post_actors_bulk_unauth(self):
+        '''
+        test post /actors/bulk without correct permission
+        '''
+        res = self.client().post(
+            '/actors/bulk', json=[{"name": "A"}],
+            headers={"Authorization": self.assistant_header})
+
+        self.assertEqual(res.status_code, 401)
+
+    def test_post_movies_bulk_not_array(self):
+        '''
+        test post /movies/bulk with a body that is not an array
+        '''
+        res = self.client().post(
+            '/movies/bulk', json={"title": "A", "release": "2000-01-01"},
+            headers={"Authorization": self.producer_header})
+
+        self.assertEqual(res.status_code, 422)
+
+    def test_patch_movies_bulk(self):
+        '''
+        test patch /movies/bulk with an existing and a missing movie
+        '''
+        res = self.client().patch(
+            '/movies/bulk', json=[
+                {"id": 2, "title": "B"},
+                {"id": 1000, "title": "C"}
+            ], headers={"Authorization": self.producer_header})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['updated'], 1)
+        self.assertEqual([r['status'] for r in data['results']], [200, 404])
+
+    def test_patch_actors_bulk_id_only(self):
+        '''
+        test patch /actors/bulk rejects an item with no field to update
+        '''
+        res = self.client().patch(
+            '/actors/bulk', json=[{"id": 1}, {"id": 2, "age": 3}],
+            headers={"Authorization": self.producer_header})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['updated'], 1)
+        self.assertEqual([r['status'] for r in data['results']], [422, 200])
+
+    def test_delete_actors_bulk(self):
+        '''
+        test delete /actors/bulk with an existing and a missing actor
+        '''
+        res = self.client().delete(
+            '/actors/bulk', json=[1, 1000],
+            headers={"Authorization": self.producer_header})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['deleted'], 1)
+        self.assertEqual([r['status'] for r in data['results']], [200, 404])
+
+
+    ##
+    def test_cast_actors(self):
+        '''
+        test post /movies/1/actors then get both sides of the cast
+        '''
+        res = self.client().post(
+            '/movies/1/actors', json={"actor_ids": [1, 2]},
+            headers={"Authorization": self.producer_header})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['cast_ids'], [1, 2])
+
+        res = self.client().get(
+            '/movies/1/actors',
+            headers={"Authorization": self.assistant_header})
+        data = json.loads(res.data)
+        self.assertEqual([a['id'] for a in data['actors']], [1, 2])
+
+        res = self.client().get(
+            '/actors/2/movies',
+            headers={"Authorization": self.assistant_header})
+        data = json.loads(res.data)
+        self.assertEqual([m['id'] for m in data['movies']], [1])
+
+    def test_cast_unknown_actor(self):
+        '''
+        test post /movies/1/actors with an actor that does not exist
+        '''
+        res = self.client().post(
+            '/movies/1/actors', json={"actor_ids": [1000]},
+            headers={"Authorization": self.producer_header})
+
+        self.assertEqual(res.status_code, 404)
+
+    def test_cast_actors_unauth(self):
+        '''
+        test post /movies/1/actors without correct permission
+        '''
+        res = self.client().post(
+            '/movies/1/actors', json={"actor_ids": [1]},
+            headers={"Authorization": self.director_header})
+
+        self.assertEqual(res.status_code, 401)
+
+    def test_uncast_actor(self):
+        '''
+        test delete /movies/1/actors/1 twice
+        '''
+        with self.app.app_context():
+            add_cast(1, [1])
+        res = self.client().delete(
+            '/movies/1/actors/1',
+            headers={"Authorization": self.producer_header})
+        self.assertEqual(res.status_code, 200)
+
+        res = self.client().delete(
+            '/movies/1/actors/1',
+            headers={"Authorization": self.producer_header})
+        self.assertEqual(res.status_code, 404)
+
+    def test_get_movies_embed_actors_query_count(self):
+        '''
+        test get /movies?embed=actors loads 100 casts in two queries
+        '''
+        statements = []
+
+        def count(conn, cursor, statement, *args):
+            # the table_versions lookup of the response cache is not counted
+            if "table_versions" not in statement:
+                statements.append(statement)
+
+        with self.app.app_context():
+            movie_ids = bulk_insert(Movie, [
+                {"title": "M%d" % i, "release": datetime(2000, 1, 1)}
+                for i in range(98)])
+            for movie_id in [1, 2] + movie_ids:
+                add_cast(movie_id, [1, 2])
+            engine = db.engine
+        event.listen(engine, "before_cursor_execute", count)
+        try:
+            res = self.client().get(
+                '/movies?embed=actors&limit=100',
+                headers={"Authorization": self.assistant_header})
+        finally:
+            event.remove(engine, "before_cursor_execute", count)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(data['movies']), 100)
+        self.assertTrue(all(len(m['actors']) == 2 for m in data['movies']))
+        self.assertEqual(len(statements), 2)
+
+    ##
+    def test_search(self):
+        '''
+        test get /search ranks exact title matches before fuzzy ones
+        '''
+        res = self.client().get(
+            '/search?q=iron%20man',
+            headers={"Authorization": self.assistant_header})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['results'][0]['type'], 'movie')
+        self.assertEqual(data['results'][0]['movie']['title'], 'Iron Man')
+        self.assertEqual(data['next_offset'], None)
+
+    def test_search_fuzzy(self):
+        '''
+        test get /search finds a misspelled actor name across both tables
+        '''
+        res = self.client().get(
+            '/search?q=Robert%20Downy&limit=1',
+            headers={"Authorization": self.assistant_header})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['results'][0]['type'], 'actor')
+        self.assertEqual(data['results'][0]['actor']['id'], 1)
+
+    def test_get_permissions(self):
+        '''
+        test get /permissions lists the permissions of each route
+        '''
+        res = self.client().get(
+            '/permissions', headers={"Authorization": self.assistant_header})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertIn({"route": "/search", "methods": ["GET"],
+                       "all_of": ["get:actors", "get:movies"],
+                       "any_of": []}, data['routes'])
+        self.assertEqual(data['granted'], ['get:actors', 'get:movies'])
+
+    def test_search_without_query(self):
+        '''
+        test get /search without q
+        '''
+        res = self.client().get(
+            '/search', headers={"Authorization": self.assistant_header})
+
+        self.assertEqual(res.status_code, 422)
+
+
+class CreateAppTestCase(unittest.TestCase):
+    """This class represents the application factory test case"""
+
+    def setUp(self):
+        """Define a throwaway SQLite database."""
+        self.directory = tempfile.mkdtemp()
+        self.database_file = os.path.join(self.directory, "casting.db")
+        self.database_path = "sqlite:///" + self.database_file
+
+    def tearDown(self):
+        """Executed after each test"""
+        shutil.rmtree(self.directory)
+
+    def test_create_app_does_not_connect(self):
+        '''
+        test building the app neither connects nor creates the tables
+        '''
+        app = create_app({"SQLALCHEMY_DATABASE_URI": self.database_path})
+
+        self.assertEqual(app.config["SQLALCHEMY_DATABASE_URI"],
+                         self.database_path)
+        self.assertFalse(os.path.exists(self.database_file))
+
+    def test_create_app_creates_tables_on_first_request(self):
+        '''
+        test the tables are created when the first request comes in
+        '''
+        app = create_app({"SQLALCHEMY_DATABASE_URI": self.database_path})
+        res = app.test_client().get('/metrics')
+
+        self.assertEqual(res.status_code, 200)
+        with app.app_context():
+            self.assertIn('actors', db.engine.table_names())
+
+    def test_create_app_without_create_tables(self):
+        '''
+        test CREATE_TABLES false leaves the schema to the migrations
+        '''
+        app = create_app({"SQLALCHEMY_DATABASE_URI": self.database_path,
+                          "CREATE_TABLES": False})
+        res = app.test_client().get('/metrics')
+
+        self.assertEqual(res.status_code, 200)
+        self.assertFalse(os.path.exists(self.database_file))
+
 
 # Make the tests conveniently executable
 if __name__ == "__main__":
@@ -0,0 +1,408 @@
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from Crypto.PublicKey import RSA
+from flask import Flask, jsonify
+import auth
+from auth import AuthError, JWKSFile, JWKSKeyStore, PEMKey, TokenCache
+from auth import Payload, Requirement, check_permissions, permission_table
+from auth import requires_auth, token_cache, verify_decode_jwt
+from tokens import KID, jwks, mint_token, public_jwk, public_pem
+
+# one key per kid, generated when first published
+KEYS = {}
+
+
+def jwk_of(kid):
+    if kid not in KEYS:
+        KEYS[kid] = public_jwk(RSA.generate(2048), kid)
+    return KEYS[kid]
+
+
+def jwks_document(*kids):
+    return {"keys": [jwk_of(kid) for kid in kids]}
+
+
+class JWKSServer:
+    '''
+    serves a JWKS document on localhost and counts the requests it receives
+    '''
+
+    def __init__(self, kids=("key1",), cache_control=None, delay=0):
+        self.kids = kids
+        self.cache_control = cache_control
+        self.delay = delay
+        self.hits = 0
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                server.hits += 1
+                time.sleep(server.delay)
+                body = json.dumps(jwks_document(*server.kids)).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                if server.cache_control:
+                    self.send_header("Cache-Control", server.cache_control)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = HTTPServer(("127.0.0.1", 0), Handler)
+        self.url = "http://127.0.0.1:{}/.well-known/jwks.json".format(
+            self.httpd.server_port)
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class JWKSKeyStoreTestCase(unittest.TestCase):
+    """This class represents the JWKS key store test case"""
+
+    def setUp(self):
+        self.server = JWKSServer()
+        self.clock = FakeClock()
+
+    def tearDown(self):
+        self.server.close()
+
+    def make_store(self, **kwargs):
+        options = {"ttl": 60, "stale_ttl": 60,
+                   "min_refresh_interval": 10, "clock": self.clock}
+        options.update(kwargs)
+        return JWKSKeyStore(self.server.url, **options)
+
+    def test_keys_are_cached(self):
+        '''
+        test repeated lookups only fetch the JWKS once
+        '''
+        store = self.make_store()
+        for _ in range(5):
+            key = store.get_key("key1")
+
+        self.assertEqual(key["n"], jwk_of("key1")["n"])
+        self.assertEqual(self.server.hits, 1)
+
+    def test_cache_control_max_age(self):
+        '''
+        test the Cache-Control max-age overrides the default ttl
+        '''
+        self.server.cache_control = "public, max-age=5"
+        store = self.make_store(min_refresh_interval=0, stale_ttl=0)
+        store.get_key("key1")
+        self.clock.now += 4
+        store.get_key("key1")
+        self.assertEqual(self.server.hits, 1)
+
+        self.clock.now += 2
+        store.get_key("key1")
+        self.assertEqual(self.server.hits, 2)
+
+    def test_unknown_kid_forces_refetch(self):
+        '''
+        test an unknown kid refetches the JWKS, at most once per interval
+        '''
+        store = self.make_store()
+        store.get_key("key1")
+        self.server.kids = ("key1", "key2")
+
+        self.assertEqual(store.get_key("key2"), None)
+        self.assertEqual(self.server.hits, 1)
+
+        self.clock.now += 11
+        self.assertEqual(store.get_key("key2")["n"],
+                         jwk_of("key2")["n"])
+        self.assertEqual(store.get_key("key3"), None)
+        self.assertEqual(self.server.hits, 2)
+
+    def test_stale_while_revalidate(self):
+        '''
+        test expired keys are served while they are refreshed in background
+        '''
+        store = self.make_store(min_refresh_interval=0)
+        store.get_key("key1")
+        self.server.delay = 0.2
+        self.clock.now += 90
+
+        started = time.monotonic()
+        self.assertEqual(store.get_key("key1")["n"],
+                         jwk_of("key1")["n"])
+        self.assertLess(time.monotonic() - started, 0.2)
+
+        store._background.join()
+        self.assertEqual(self.server.hits, 2)
+
+    def test_expired_keys_are_not_served(self):
+        '''
+        test keys past the stale window are dropped when Auth0 is down
+        '''
+        store = self.make_store(min_refresh_interval=0)
+        store.get_key("key1")
+        self.server.close()
+        self.clock.now += 121
+
+        self.assertEqual(store.get_key("key1"), None)
+
+    def test_single_flight_refresh(self):
+        '''
+        test concurrent lookups on an empty store share a single fetch
+        '''
+        self.server.delay = 0.2
+        store = self.make_store()
+        keys = []
+        threads = [
+            threading.Thread(target=lambda: keys.append(store.get_key("key1")))
+            for _ in range(10)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(self.server.hits, 1)
+        self.assertEqual(len(keys), 10)
+        self.assertTrue(all(keys))
+
+
+class LocalKeysTestCase(unittest.TestCase):
+    """This class represents the local key providers test case"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.provider = auth.key_provider
+
+    def tearDown(self):
+        auth.key_provider = self.provider
+        shutil.rmtree(self.directory)
+
+    def token(self, **kwargs):
+        return mint_token(["get:actors"], **kwargs).split(" ")[1]
+
+    def test_jwks_file(self):
+        '''
+        test the keys of a JWKS file are looked up by kid
+        '''
+        path = os.path.join(self.directory, "jwks.json")
+        with open(path, "w") as f:
+            json.dump(jwks(), f)
+        provider = JWKSFile(path)
+
+        self.assertEqual(provider.get_key(KID)["n"],
+                         jwks()["keys"][0]["n"])
+        self.assertEqual(provider.get_key("other"), None)
+        self.assertEqual(provider.fetches, 0)
+
+    def test_jwks_file_skips_unusable_keys(self):
+        '''
+        test encryption keys and malformed keys are left out of a JWKS file
+        '''
+        path = os.path.join(self.directory, "jwks.json")
+        encryption = dict(jwk_of("key1"), use="enc")
+        malformed = {"kty": "RSA", "kid": "key2", "use": "sig"}
+        with open(path, "w") as f:
+            json.dump({"keys": [encryption, malformed] + jwks()["keys"]}, f)
+        provider = JWKSFile(path)
+
+        self.assertEqual(provider.get_key("key1"), None)
+        self.assertEqual(provider.get_key("key2"), None)
+        self.assertTrue(provider.get_key(KID))
+
+    def test_pem_key_verifies_token(self):
+        '''
+        test a token signed by the local key is verified without network
+        '''
+        auth.key_provider = PEMKey(public_pem())
+        payload = verify_decode_jwt(self.token())
+
+        self.assertEqual(payload["permissions"], ["get:actors"])
+
+    def test_pem_key_rejects_other_signer(self):
+        '''
+        test a token signed by another key is rejected
+        '''
+        other = RSA.generate(2048).publickey().exportKey().decode()
+        auth.key_provider = PEMKey(other)
+
+        with self.assertRaises(AuthError):
+            verify_decode_jwt(self.token())
+
+    def test_expired_token(self):
+        '''
+        test an expired token is rejected
+        '''
+        auth.key_provider = PEMKey(public_pem())
+
+        with self.assertRaises(AuthError) as context:
+            verify_decode_jwt(self.token(lifetime=-60))
+        self.assertEqual(context.exception.error["code"], "token_expired")
+
+
+class PermissionsTestCase(unittest.TestCase):
+    """This class represents the permission requirements test case"""
+
+    def setUp(self):
+        self.provider = auth.key_provider
+        auth.key_provider = PEMKey(public_pem())
+        token_cache.clear()
+        self.app = Flask(__name__)
+
+        @self.app.route("/all")
+        @requires_auth("get:actors", "get:movies")
+        def all_of(payload):
+            return jsonify(sorted(payload.granted))
+
+        @self.app.route("/any", methods=["GET", "POST"])
+        @requires_auth(any_of=("modify:actor", "modify:movie"))
+        def any_of(payload):
+            return jsonify([])
+
+        @self.app.errorhandler(AuthError)
+        def auth_error(error):
+            return jsonify(error.error), error.status_code
+
+    def tearDown(self):
+        auth.key_provider = self.provider
+        token_cache.clear()
+
+    def get(self, path, permissions):
+        return self.app.test_client().get(
+            path, headers={"Authorization": mint_token(permissions)})
+
+    def test_requirement(self):
+        '''
+        test all_of needs every permission and any_of needs one of them
+        '''
+        requirement = Requirement(["a", "b"], any_of=["c", "d"])
+
+        self.assertTrue(requirement.satisfied_by(frozenset("abd")))
+        self.assertFalse(requirement.satisfied_by(frozenset("ad")))
+        self.assertFalse(requirement.satisfied_by(frozenset("ab")))
+        self.assertTrue(Requirement().satisfied_by(frozenset()))
+
+    def test_payload_compiles_permissions(self):
+        '''
+        test the permissions of a payload are compiled into a frozenset
+        '''
+        payload = Payload({"sub": "a", "permissions": ["get:actors"]})
+
+        self.assertEqual(payload.granted, frozenset(["get:actors"]))
+        self.assertEqual(payload["sub"], "a")
+        self.assertEqual(Payload({"sub": "a"}).granted, None)
+
+    def test_check_permissions(self):
+        '''
+        test check_permissions accepts plain payloads and Payloads
+        '''
+        payload = {"permissions": ["get:actors"]}
+
+        self.assertTrue(check_permissions("get:actors", payload))
+        self.assertTrue(check_permissions("get:actors", Payload(payload)))
+        with self.assertRaises(AuthError) as context:
+            check_permissions("get:movies", Payload(payload))
+        self.assertEqual(context.exception.status_code, 403)
+        with self.assertRaises(AuthError) as context:
+            check_permissions("get:movies", Payload({}))
+        self.assertEqual(context.exception.status_code, 400)
+
+    def test_all_of(self):
+        '''
+        test a route requiring two permissions
+        '''
+        res = self.get("/all", ["get:actors", "get:movies"])
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.get_json(), ["get:actors", "get:movies"])
+        self.assertEqual(self.get("/all", ["get:actors"]).status_code, 403)
+
+    def test_any_of(self):
+        '''
+        test a route requiring one of two permissions
+        '''
+        self.assertEqual(self.get("/any", ["modify:movie"]).status_code, 200)
+        self.assertEqual(self.get("/any", ["get:movies"]).status_code, 403)
+
+    def test_permission_table(self):
+        '''
+        test the requirements of the routes are listed
+        '''
+        self.assertEqual(permission_table(self.app), [
+            {"route": "/all", "methods": ["GET"],
+             "all_of": ["get:actors", "get:movies"], "any_of": []},
+            {"route": "/any", "methods": ["GET", "POST"],
+             "all_of": [], "any_of": ["modify:actor", "modify:movie"]},
+        ])
+
+
+class TokenCacheTestCase(unittest.TestCase):
+    """This class represents the verified token cache test case"""
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.cache = TokenCache(maxsize=2, clock=self.clock)
+
+    def test_hit_and_miss(self):
+        '''
+        test a verified payload is returned for the same token only
+        '''
+        payload = {"sub": "a", "exp": self.clock.now + 60}
+        self.assertEqual(self.cache.get("token-a"), None)
+        self.cache.set("token-a", payload)
+
+        self.assertEqual(self.cache.get("token-a"), payload)
+        self.assertEqual(self.cache.get("token-b"), None)
+        self.assertEqual(self.cache.stats()["hits"], 1)
+        self.assertEqual(self.cache.stats()["misses"], 2)
+
+    def test_entry_expires_at_exp(self):
+        '''
+        test a payload is not returned once the token expired
+        '''
+        self.cache.set("token-a", {"exp": self.clock.now + 60})
+        self.clock.now += 60
+
+        self.assertEqual(self.cache.get("token-a"), None)
+        self.assertEqual(self.cache.stats()["size"], 0)
+
+    def test_token_without_exp_not_cached(self):
+        '''
+        test a payload without exp claim is never cached
+        '''
+        self.cache.set("token-a", {"sub": "a"})
+
+        self.assertEqual(self.cache.get("token-a"), None)
+
+    def test_least_recently_used_evicted(self):
+        '''
+        test the least recently used token is evicted when the cache is full
+        '''
+        exp = self.clock.now + 60
+        self.cache.set("token-a", {"sub": "a", "exp": exp})
+        self.cache.set("token-b", {"sub": "b", "exp": exp})
+        self.cache.get("token-a")
+        self.cache.set("token-c", {"sub": "c", "exp": exp})
+
+        self.assertTrue(self.cache.get("token-a"))
+        self.assertEqual(self.cache.get("token-b"), None)
+        self.assertTrue(self.cache.get("token-c"))
+
+
+# Make the tests conveniently executable
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,168 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+from flask import Flask, jsonify
+from sqlalchemy import event
+from cache import LocalCache, cached_response, conditional_response
+from models import db, setup_db, Actor
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class LocalCacheTestCase(unittest.TestCase):
+    """This class represents the in-process cache backend test case"""
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.cache = LocalCache(maxsize=2, clock=self.clock)
+
+    def test_get_and_set(self):
+        '''
+        test a value is returned until its expiry
+        '''
+        self.cache.set("a", b"1", ex=10)
+
+        self.assertEqual(self.cache.get("a"), b"1")
+        self.assertEqual(self.cache.get("b"), None)
+        self.clock.now += 10
+        self.assertEqual(self.cache.get("a"), None)
+
+    def test_least_recently_used_evicted(self):
+        '''
+        test the least recently used value is evicted when the cache is full
+        '''
+        self.cache.set("a", b"1")
+        self.cache.set("b", b"2")
+        self.cache.get("a")
+        self.cache.set("c", b"3")
+
+        self.assertEqual(self.cache.get("a"), b"1")
+        self.assertEqual(self.cache.get("b"), None)
+        self.assertEqual(self.cache.get("c"), b"3")
+
+
+class VersionedCacheTestCase(unittest.TestCase):
+    """This class represents the versioned response cache test case"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.database_file = os.path.join(self.directory, "casting.db")
+        self.app = Flask(__name__)
+        setup_db(self.app, "sqlite:///" + self.database_file)
+        self.calls = 0
+
+        @self.app.route("/count")
+        @cached_response("actors")
+        def count():
+            self.calls += 1
+            return jsonify(Actor.query.count())
+
+        @self.app.route("/conditional")
+        @conditional_response("actors")
+        def conditional():
+            return jsonify(Actor.query.count())
+
+        @self.app.route("/both")
+        @conditional_response("actors")
+        @cached_response("actors")
+        def both():
+            self.calls += 1
+            return jsonify(Actor.query.count())
+
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        with self.app.app_context():
+            db.session.remove()
+            db.drop_all()
+        shutil.rmtree(self.directory)
+
+    def write_from_another_process(self):
+        '''
+        commit an actor the way another worker or manage.py does, without
+        touching anything in this process
+        '''
+        connection = sqlite3.connect(self.database_file)
+        with connection:
+            connection.execute(
+                "INSERT INTO actors (name, age, gender) "
+                "VALUES ('Ada', 41, 'Female')")
+            connection.execute(
+                "UPDATE table_versions SET version = version + 1 "
+                "WHERE name = 'actors'")
+        connection.close()
+
+    def test_cached_until_write(self):
+        '''
+        test a list is served from the cache while its table is unchanged
+        '''
+        self.assertEqual(self.client.get("/count").get_json(), 0)
+        self.assertEqual(self.client.get("/count").get_json(), 0)
+        self.assertEqual(self.calls, 1)
+
+        with self.app.app_context():
+            Actor(name="Ada", age=41, gender="Female").insert()
+        self.assertEqual(self.client.get("/count").get_json(), 1)
+        self.assertEqual(self.calls, 2)
+
+    def test_write_from_another_process(self):
+        '''
+        test a write committed by another process invalidates the cache
+        '''
+        self.assertEqual(self.client.get("/count").get_json(), 0)
+        self.write_from_another_process()
+
+        self.assertEqual(self.client.get("/count").get_json(), 1)
+
+    def test_versions_read_once_per_request(self):
+        '''
+        test a cache hit below conditional_response costs one query
+        '''
+        self.client.get("/both")
+        statements = []
+
+        def count(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        with self.app.app_context():
+            engine = db.engine
+        event.listen(engine, "before_cursor_execute", count)
+        try:
+            res = self.client.get("/both")
+        finally:
+            event.remove(engine, "before_cursor_execute", count)
+
+        self.assertEqual(res.get_json(), 0)
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(len(statements), 1)
+        self.assertIn("table_versions", statements[0])
+
+    def test_etag_changes_after_write_from_another_process(self):
+        '''
+        test the ETag is answered with 304 until another process writes
+        '''
+        etag = self.client.get("/conditional").headers["ETag"]
+        res = self.client.get("/conditional",
+                              headers={"If-None-Match": etag})
+        self.assertEqual(res.status_code, 304)
+
+        self.write_from_another_process()
+        res = self.client.get("/conditional",
+                              headers={"If-None-Match": etag})
+
+        self.assertEqual(res.status_code, 200)
+        self.assertNotEqual(res.headers["ETag"], etag)
+        self.assertEqual(res.get_json(), 1)
+
+
+# Make the tests conveniently executable
+if __name__ == "__main__":
+    unittest.main()
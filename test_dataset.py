@@ -0,0 +1,178 @@
+import datetime
+import io
+import os
+import shutil
+import tempfile
+import unittest
+from flask import Flask, jsonify
+from cache import cached_response, table_version
+from dataset import copy_text, generate_file, generate_records
+from dataset import import_file, import_rows, read_rows, write_records
+from models import db, setup_db, Actor, Movie
+
+
+class ReadRowsTestCase(unittest.TestCase):
+    """This class represents the dataset file reader test case"""
+
+    def test_csv(self):
+        '''
+        test CSV records are converted to rows, empty fields being NULL
+        '''
+        f = io.StringIO("name,age,gender\nAda Lopez,41,Female\nBen,,Male\n")
+
+        self.assertEqual(list(read_rows(f, "actors", "csv")), [
+            ("Ada Lopez", 41, "Female"), ("Ben", None, "Male")])
+
+    def test_ndjson(self):
+        '''
+        test NDJSON records are converted to rows, blank lines skipped
+        '''
+        f = io.StringIO('{"title": "Iron Man", "release": "2008-05-02"}\n'
+                        '\n{"title": "Untitled"}\n')
+
+        self.assertEqual(list(read_rows(f, "movies", "ndjson")), [
+            ("Iron Man", datetime.datetime(2008, 5, 2)), ("Untitled", None)])
+
+    def test_malformed_record(self):
+        '''
+        test a malformed record is reported with its number
+        '''
+        f = io.StringIO('{"name": "Ada", "age": 41}\n{"name": "Ben", '
+                        '"age": "old"}\n')
+
+        with self.assertRaises(ValueError) as context:
+            list(read_rows(f, "actors", "ndjson"))
+        self.assertIn("record 2", str(context.exception))
+
+    def test_copy_text(self):
+        '''
+        test rows are escaped for COPY, None being \\N
+        '''
+        self.assertEqual(
+            copy_text([("Tab\tand\\slash", None),
+                       ("New\nline", datetime.datetime(2008, 5, 2))]),
+            "Tab\\tand\\\\slash\t\\N\n"
+            "New\\nline\t2008-05-02T00:00:00\n")
+
+
+class GenerateTestCase(unittest.TestCase):
+    """This class represents the synthetic dataset test case"""
+
+    def test_same_seed_same_records(self):
+        '''
+        test the records only depend on the seed
+        '''
+        self.assertEqual(list(generate_records("actors", 5, seed=1)),
+                         list(generate_records("actors", 5, seed=1)))
+        self.assertNotEqual(list(generate_records("movies", 5, seed=1)),
+                            list(generate_records("movies", 5, seed=2)))
+
+    def test_generated_records_can_be_read(self):
+        '''
+        test generated CSV and NDJSON files read back as valid rows
+        '''
+        for format in ("csv", "ndjson"):
+            f = io.StringIO()
+            write_records(f, "movies", generate_records("movies", 20),
+                          format)
+            f.seek(0)
+            rows = list(read_rows(f, "movies", format))
+
+            self.assertEqual(len(rows), 20)
+            self.assertTrue(all(isinstance(release, datetime.datetime)
+                                for title, release in rows))
+
+
+class ImportTestCase(unittest.TestCase):
+    """This class represents the dataset import test case"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.app = Flask(__name__)
+        setup_db(self.app, "sqlite://")
+        self.context = self.app.app_context()
+        self.context.push()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.context.pop()
+        shutil.rmtree(self.directory)
+
+    def test_import_rows_in_batches(self):
+        '''
+        test rows are written in batches and the list caches invalidated
+        '''
+        before = table_version("actors")
+        count = import_rows("actors", (
+            ("Actor %d" % i, 30, "Female") for i in range(25)), batch_size=10)
+
+        self.assertEqual(count, 25)
+        self.assertEqual(Actor.query.count(), 25)
+        self.assertNotEqual(table_version("actors"), before)
+
+    def test_malformed_file_imports_nothing(self):
+        '''
+        test a malformed record rolls the whole import back
+        '''
+        path = os.path.join(self.directory, "actors.csv")
+        with open(path, "w") as f:
+            f.write("name,age,gender\nAda,41,Female\nBen,old,Male\n")
+
+        with self.assertRaises(ValueError):
+            import_file(path, "actors", batch_size=1)
+        self.assertEqual(Actor.query.count(), 0)
+
+    def test_import_generated_file(self):
+        '''
+        test a generated file is imported with every record
+        '''
+        path = os.path.join(self.directory, "movies.ndjson")
+        generate_file(path, "movies", 100, seed=3)
+        count, seconds = import_file(path, "movies", batch_size=30)
+
+        self.assertEqual(count, 100)
+        self.assertEqual(Movie.query.count(), 100)
+
+
+class ImportInvalidatesServerTestCase(unittest.TestCase):
+    """This class represents the import seen by a running server test case"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        path = "sqlite:///" + os.path.join(self.directory, "casting.db")
+        # the server and manage.py each have their own app and engine
+        self.server = Flask(__name__)
+        setup_db(self.server, path)
+        self.command = Flask(__name__)
+        setup_db(self.command, path, create_tables=False)
+
+        @self.server.route("/count")
+        @cached_response("actors")
+        def count():
+            return jsonify(Actor.query.count())
+
+        self.client = self.server.test_client()
+
+    def tearDown(self):
+        with self.server.app_context():
+            db.session.remove()
+            db.drop_all()
+        with self.command.app_context():
+            db.session.remove()
+        shutil.rmtree(self.directory)
+
+    def test_server_sees_import(self):
+        '''
+        test an import by another app invalidates the server's cached list
+        '''
+        self.assertEqual(self.client.get("/count").get_json(), 0)
+        with self.command.app_context():
+            import_rows("actors", [("Ada", 41, "Female")])
+
+        self.assertEqual(self.client.get("/count").get_json(), 1)
+
+
+# Make the tests conveniently executable
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,35 @@
+import datetime
+import json
+import unittest
+from encoder import BACKENDS, select_backend
+
+
+class EncoderTestCase(unittest.TestCase):
+    """This class represents the response encoder test case"""
+
+    def test_backends_encode_dates(self):
+        '''
+        test every installed backend encodes datetimes as ISO 8601
+        '''
+        payload = {"id": 1, "release": datetime.datetime(2008, 5, 2)}
+        for name, backend in BACKENDS.items():
+            try:
+                dumps = backend()
+            except (ImportError, TypeError):
+                continue
+            self.assertEqual(json.loads(dumps(payload)),
+                             {"id": 1, "release": "2008-05-02T00:00:00"})
+
+    def test_missing_backend_falls_back(self):
+        '''
+        test an unknown backend falls back to the standard library
+        '''
+        name, dumps = select_backend("missing")
+
+        self.assertEqual(name, "json")
+        self.assertEqual(dumps({"a": 1}), b'{"a":1}')
+
+
+# Make the tests conveniently executable
+if __name__ == "__main__":
+    unittest.main()
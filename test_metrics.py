@@ -0,0 +1,112 @@
+import unittest
+from flask import Flask, Response, stream_with_context
+from metrics import Histogram, Registry, init_metrics, registry, timed
+
+
+class HistogramTestCase(unittest.TestCase):
+    """This class represents the latency histogram test case"""
+
+    def test_cumulative_buckets(self):
+        '''
+        test observations are counted in every bucket above them
+        '''
+        histogram = Histogram(buckets=(0.1, 1.0))
+        for value in (0.05, 0.5, 5.0):
+            histogram.observe(value)
+        buckets, total = histogram.cumulative()
+
+        self.assertEqual(buckets, [(0.1, 1), (1.0, 2), ('+Inf', 3)])
+        self.assertAlmostEqual(total, 5.55)
+
+    def test_exposition(self):
+        '''
+        test histograms are written in the Prometheus text format
+        '''
+        metrics = Registry()
+        metrics.observe("latency_seconds", 0.002, route="/actors")
+        lines = metrics.exposition()
+
+        self.assertEqual(lines[0], '# TYPE latency_seconds histogram')
+        self.assertIn('latency_seconds_bucket{route="/actors",le="0.0025"} 1',
+                      lines)
+        self.assertIn('latency_seconds_count{route="/actors"} 1', lines)
+
+
+class RequestMetricsTestCase(unittest.TestCase):
+    """This class represents the per-request timing test case"""
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        init_metrics(self.app, {
+            "widget_cache": (lambda: {"hits": 3}, "widget cache")})
+
+        @self.app.route("/widgets")
+        def widgets():
+            with timed("db"):
+                pass
+            return "[]"
+
+        @self.app.route("/widgets/export")
+        def export():
+            def generate():
+                for i in range(3):
+                    with timed("format"):
+                        yield "{}\n"
+            return Response(stream_with_context(generate()))
+
+        registry.clear()
+        self.client = self.app.test_client()
+
+    def test_server_timing(self):
+        '''
+        test responses carry the duration of each phase and the total
+        '''
+        res = self.client.get("/widgets")
+        phases = [part.split(";")[0]
+                  for part in res.headers["Server-Timing"].split(", ")]
+
+        self.assertEqual(phases, ["db", "total"])
+
+    def test_metrics_endpoint(self):
+        '''
+        test /metrics exports request histograms per route and the sources
+        '''
+        self.client.get("/widgets")
+        res = self.client.get("/metrics")
+        body = res.get_data(as_text=True)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertIn('casting_request_duration_seconds_count{method="GET",'
+                      'route="/widgets",status="200"} 1', body)
+        self.assertIn('casting_request_phase_seconds_count{phase="db",'
+                      'route="/widgets"} 1', body)
+        self.assertIn('widget_cache{stat="hits"} 3', body)
+
+    def test_streamed_phases_observed_when_sent(self):
+        '''
+        test the phases of a streamed body are observed once it is sent
+        '''
+        res = self.client.get("/widgets/export", buffered=False)
+        self.assertNotIn('phase="format"', "\n".join(registry.exposition()))
+
+        self.assertEqual(res.get_data(as_text=True), "{}\n" * 3)
+        res.close()
+        lines = registry.exposition()
+
+        self.assertIn('casting_request_phase_seconds_count{phase="format",'
+                      'route="/widgets/export"} 1', lines)
+        self.assertIn('casting_request_duration_seconds_count{method="GET",'
+                      'route="/widgets/export",status="200"} 1', lines)
+
+    def test_timed_outside_request(self):
+        '''
+        test timed blocks outside of a request are not recorded
+        '''
+        with timed("db"):
+            pass
+        self.assertEqual(registry.exposition(), [])
+
+
+# Make the tests conveniently executable
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,297 @@
+import datetime
+import sqlite3
+import unittest
+from unittest import mock
+from flask import Flask
+from sqlalchemy import event, exc
+from sqlalchemy.dialects import postgresql
+from cache import table_version
+from models import db, engine_options, not_deleted, setup_db, unit_of_work
+from models import bulk_insert, insert_statements, INSERT_CHUNK_SIZE
+from models import pool_stats, Actor, InstrumentedQueuePool, Movie
+
+
+class EngineOptionsTestCase(unittest.TestCase):
+    """This class represents the connection pool configuration test case"""
+
+    def test_postgres_pool_options(self):
+        '''
+        test a Postgres engine gets the instrumented, pre-pinged pool
+        '''
+        options = engine_options("postgresql://localhost:5432/casting")
+
+        self.assertIs(options['poolclass'], InstrumentedQueuePool)
+        self.assertTrue(options['pool_pre_ping'])
+        for name in ('pool_size', 'max_overflow', 'pool_timeout',
+                     'pool_recycle'):
+            self.assertIn(name, options)
+        self.assertTrue(options['use_batch_mode'])
+
+    def test_batch_mode_only_for_psycopg2(self):
+        '''
+        test other Postgres drivers do not get the psycopg2 batch mode
+        '''
+        options = engine_options("postgresql+pg8000://localhost/casting")
+
+        self.assertNotIn('use_batch_mode', options)
+
+    def test_overrides(self):
+        '''
+        test explicit options take precedence over the environment
+        '''
+        options = engine_options(
+            "postgresql://localhost:5432/casting", pool_size=20)
+
+        self.assertEqual(options['pool_size'], 20)
+
+    def test_sqlite_keeps_default_pool(self):
+        '''
+        test SQLite gets no pool options
+        '''
+        self.assertEqual(engine_options("sqlite:///casting.db"), {})
+
+    def test_only_checkout_timeouts_counted(self):
+        '''
+        test a pool timeout is counted, a failed connect is not
+        '''
+        before = pool_stats['timeouts']
+        pool = InstrumentedQueuePool(lambda: sqlite3.connect(":memory:"),
+                                     pool_size=1, max_overflow=0, timeout=0)
+        connection = pool.connect()
+        with self.assertRaises(exc.TimeoutError):
+            pool.connect()
+        connection.close()
+        self.assertEqual(pool_stats['timeouts'], before + 1)
+
+        def refuse():
+            raise sqlite3.OperationalError("connection refused")
+
+        with self.assertRaises(sqlite3.OperationalError):
+            InstrumentedQueuePool(refuse).connect()
+        self.assertEqual(pool_stats['timeouts'], before + 1)
+
+
+class UnitOfWorkTestCase(unittest.TestCase):
+    """This class represents the unit of work test case"""
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        setup_db(self.app, "sqlite://")
+        self.context = self.app.app_context()
+        self.context.push()
+        self.commits = []
+        event.listen(db.engine, "commit", self.count_commit)
+
+    def tearDown(self):
+        event.remove(db.engine, "commit", self.count_commit)
+        db.session.remove()
+        db.drop_all()
+        self.context.pop()
+
+    def count_commit(self, connection):
+        self.commits.append(connection)
+
+    def actor(self, name):
+        return Actor(name=name, age=30, gender="Female")
+
+    def test_single_commit(self):
+        '''
+        test the writes of a unit of work are committed once
+        '''
+        with unit_of_work():
+            actors = [self.actor("Actor %d" % i) for i in range(3)]
+            for actor in actors:
+                actor.insert()
+            actors[0].name = "Renamed"
+            actors[0].update()
+            actors[1].delete()
+
+        self.assertEqual(len(self.commits), 1)
+        self.assertEqual(sorted(name for name, in db.session.query(
+            Actor.name)), ["Actor 2", "Renamed"])
+
+    def test_ids_assigned_before_commit(self):
+        '''
+        test an inserted row gets its id inside the unit of work
+        '''
+        with unit_of_work():
+            actor = self.actor("Actor")
+            actor.insert()
+            self.assertIsNotNone(actor.id)
+            self.assertEqual(self.commits, [])
+
+    def test_versions_bumped_on_commit(self):
+        '''
+        test the table versions change only once the unit commits
+        '''
+        before = table_version("actors")
+        with unit_of_work():
+            self.actor("Actor").insert()
+            self.assertEqual(table_version("actors"), before)
+
+        self.assertNotEqual(table_version("actors"), before)
+
+    def test_rollback_on_error(self):
+        '''
+        test an exception rolls back every write of the unit of work
+        '''
+        before = table_version("actors")
+        with self.assertRaises(ValueError):
+            with unit_of_work():
+                self.actor("Actor").insert()
+                raise ValueError()
+
+        self.assertEqual(Actor.query.count(), 0)
+        self.assertEqual(table_version("actors"), before)
+        self.assertEqual(self.commits, [])
+
+    def test_nested_units_commit_once(self):
+        '''
+        test a nested unit of work joins the outer one
+        '''
+        @unit_of_work()
+        def insert(name):
+            self.actor(name).insert()
+
+        with unit_of_work():
+            insert("First")
+            insert("Second")
+            self.assertEqual(self.commits, [])
+
+        self.assertEqual(len(self.commits), 1)
+        self.assertEqual(Actor.query.count(), 2)
+
+    def test_delete_honours_soft_delete(self):
+        '''
+        test deleting an actor object keeps a tombstone with SOFT_DELETE
+        '''
+        actor = self.actor("Actor")
+        actor.insert()
+        with mock.patch("models.SOFT_DELETE", True):
+            actor.delete()
+
+        self.assertIsNotNone(actor.deleted_at)
+        self.assertEqual(actor.version, 2)
+        self.assertEqual(Actor.query.filter(not_deleted(Actor)).count(), 0)
+
+    def test_delete_with_pending_change(self):
+        '''
+        test deleting an actor object with unsaved changes removes its row
+        '''
+        actor = self.actor("Actor")
+        actor.insert()
+        actor.name = "Renamed"
+        actor.delete()
+
+        self.assertEqual(actor.name, "Renamed")
+        self.assertEqual(Actor.query.count(), 0)
+
+        actor = self.actor("Soft")
+        actor.insert()
+        actor.name = "Renamed"
+        with mock.patch("models.SOFT_DELETE", True):
+            actor.delete()
+
+        self.assertEqual(actor.name, "Renamed")
+        self.assertIsNotNone(actor.deleted_at)
+
+    def test_without_unit_each_write_commits(self):
+        '''
+        test the helpers still commit on their own outside a unit of work
+        '''
+        self.actor("First").insert()
+        self.actor("Second").insert()
+
+        self.assertEqual(len(self.commits), 2)
+
+
+class FormatRowsTestCase(unittest.TestCase):
+    """This class represents the column tuple formatting test case"""
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        setup_db(self.app, "sqlite://")
+        self.context = self.app.app_context()
+        self.context.push()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.context.pop()
+
+    def test_same_as_format(self):
+        '''
+        test format_rows of the column tuples matches format() of each object
+        '''
+        Movie(title="Iron Man", release=datetime.datetime(2008, 5, 2)).insert()
+        Movie(title="Untitled", release=None).insert()
+        Actor(name="Ada", age=41, gender="Female").insert()
+        Actor(name="Ben", age=None, gender=None).insert()
+
+        for model in (Movie, Actor):
+            self.assertEqual(
+                model.format_rows(model.rows().order_by(model.id)),
+                [row.format() for row in model.query.order_by(model.id)])
+
+
+class BulkInsertTestCase(unittest.TestCase):
+    """This class represents the bulk insert test case"""
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        setup_db(self.app, "sqlite://")
+        self.context = self.app.app_context()
+        self.context.push()
+        self.inserts = []
+        event.listen(db.engine, "before_cursor_execute", self.count_insert)
+
+    def tearDown(self):
+        event.remove(db.engine, "before_cursor_execute", self.count_insert)
+        db.session.remove()
+        db.drop_all()
+        self.context.pop()
+
+    def count_insert(self, connection, cursor, statement, parameters,
+                     context, executemany):
+        if statement.startswith("INSERT INTO actors"):
+            self.inserts.append(statement)
+
+    def test_one_statement_and_ids_in_order(self):
+        '''
+        test the rows are sent in one executemany and get their ids in order
+        '''
+        Actor(name="Existing", age=30, gender="Male").insert()
+        del self.inserts[:]
+        rows = [{"name": "Actor %d" % i, "age": 30} for i in range(50)]
+        rows[7]["gender"] = "Female"
+
+        ids = bulk_insert(Actor, rows)
+
+        self.assertEqual(len(self.inserts), 1)
+        self.assertEqual([row["id"] for row in rows], ids)
+        self.assertEqual(
+            [(actor.id, actor.name) for actor in Actor.query.filter(
+                Actor.id.in_(ids)).order_by(Actor.id)],
+            [(id, "Actor %d" % i) for i, id in enumerate(ids)])
+        self.assertEqual(Actor.query.get(ids[7]).gender, "Female")
+
+    def test_postgres_multi_row_statements(self):
+        '''
+        test Postgres gets one multi-row INSERT ... RETURNING per chunk
+        '''
+        rows = [{"name": "Actor %d" % i, "age": 30}
+                for i in range(INSERT_CHUNK_SIZE * 2 + 1)]
+        statements = [
+            str(statement.compile(dialect=postgresql.dialect()))
+            for statement in insert_statements(Actor.__table__, rows)]
+
+        self.assertEqual(len(statements), 3)
+        self.assertTrue(all(s.endswith("RETURNING actors.id")
+                            for s in statements))
+        self.assertEqual(statements[0].count("%(name_m"), INSERT_CHUNK_SIZE)
+        self.assertEqual(statements[2].count("%(name_m"), 1)
+
+
+# Make the tests conveniently executable
+if __name__ == "__main__":
+    unittest.main()
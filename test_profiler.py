@@ -0,0 +1,65 @@
+import unittest
+from flask import Flask, g
+from sqlalchemy import create_engine
+from profiler import RequestProfile, install_profiler
+
+
+class RequestProfileTestCase(unittest.TestCase):
+    """This class represents the request profile test case"""
+
+    def test_slowest_and_repeated(self):
+        '''
+        test the slowest statements and the repeated ones are reported
+        '''
+        profile = RequestProfile()
+        profile.record("SELECT movies", 0.003)
+        for _ in range(5):
+            profile.record("SELECT actors WHERE movie_id = ?", 0.001)
+
+        self.assertEqual(profile.count, 6)
+        self.assertAlmostEqual(profile.seconds, 0.008)
+        self.assertEqual(profile.slowest(1), [(0.003, "SELECT movies")])
+        self.assertEqual(profile.repeated(5),
+                         [("SELECT actors WHERE movie_id = ?", 5)])
+        self.assertEqual(profile.repeated(6), [])
+
+
+class ProfilerTestCase(unittest.TestCase):
+    """This class represents the per-request statement profiler test case"""
+
+    def setUp(self):
+        self.engine = create_engine("sqlite://")
+        self.app = Flask(__name__)
+        install_profiler(self.app, self.engine)
+
+        @self.app.route("/lookups/<int:count>")
+        def lookups(count):
+            with self.engine.connect() as connection:
+                for i in range(count):
+                    connection.execute("SELECT ?", i).scalar()
+            return "ok"
+
+        self.client = self.app.test_client()
+
+    def test_statements_are_counted(self):
+        '''
+        test the statements of a request are recorded in g.query_profile
+        '''
+        with self.client:
+            self.client.get("/lookups/2")
+            self.assertEqual(g.query_profile.count, 2)
+
+    def test_repeated_statement_is_logged(self):
+        '''
+        test a statement repeated in a request is logged as a possible N+1
+        '''
+        with self.assertLogs("profiler", level="WARNING") as logs:
+            self.client.get("/lookups/25")
+
+        self.assertTrue(any("25 statements" in line for line in logs.output))
+        self.assertTrue(any("possible N+1" in line for line in logs.output))
+
+
+# Make the tests conveniently executable
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,65 @@
+import unittest
+from search import TrigramIndex, similarity, trigrams
+
+
+class TrigramTestCase(unittest.TestCase):
+    """This class represents the trigram helpers test case"""
+
+    def test_trigrams_match_pg_trgm(self):
+        '''
+        test words are lowercased and padded as pg_trgm does
+        '''
+        self.assertEqual(trigrams("Cat"),
+                         {"  c", " ca", "cat", "at "})
+        self.assertEqual(trigrams("a-b"), {"  a", " a ", "  b", " b "})
+
+    def test_similarity(self):
+        '''
+        test similarity is the ratio of shared trigrams
+        '''
+        self.assertEqual(similarity(trigrams("word"), trigrams("word")), 1.0)
+        self.assertEqual(similarity(trigrams("word"), trigrams("xyz")), 0.0)
+        self.assertAlmostEqual(
+            similarity(trigrams("word"), trigrams("two words")), 4 / 11)
+
+
+class TrigramIndexTestCase(unittest.TestCase):
+    """This class represents the in-memory search index test case"""
+
+    def setUp(self):
+        self.index = TrigramIndex([
+            (("actor", 1), "Robert Downey Jr."),
+            (("actor", 2), "Shia LaBeouf"),
+            (("movie", 1), "Transformers"),
+            (("movie", 2), "Iron Man"),
+            (("movie", 3), "Iron Man 2"),
+        ])
+
+    def test_full_text_match_first(self):
+        '''
+        test documents containing every word rank before fuzzy matches
+        '''
+        keys = [key for key, full_text, score in self.index.search("iron man")]
+
+        self.assertEqual(keys, [("movie", 2), ("movie", 3)])
+
+    def test_fuzzy_match(self):
+        '''
+        test a misspelled query still finds the closest documents
+        '''
+        matches = self.index.search("Robert Downy")
+
+        self.assertEqual(matches[0][0], ("actor", 1))
+        self.assertFalse(matches[0][1])
+
+    def test_no_match(self):
+        '''
+        test unrelated queries return nothing
+        '''
+        self.assertEqual(self.index.search("zzz"), [])
+        self.assertEqual(self.index.search("!!"), [])
+
+
+# Make the tests conveniently executable
+if __name__ == "__main__":
+    unittest.main()
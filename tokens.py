@@ -0,0 +1,66 @@
+'''
+tokens.py
+    tokens signed by a key generated when this module is imported, so the
+    tests and bench.py run without Auth0
+
+    requires_auth accepts them once the key is installed, either in process
+    with auth.key_provider = PEMKey(public_pem()), or in other processes
+    with JWT_PUBLIC_KEY=public_pem() or a JWKS_FILE holding jwks()
+'''
+import base64
+import os
+import time
+from Crypto.PublicKey import RSA
+from jose import jwt
+
+KID = 'local'
+SIGNING_KEY = RSA.generate(2048)
+PRIVATE_PEM = SIGNING_KEY.exportKey().decode()
+
+# permissions of the roles set up in Auth0
+ROLES = {
+    'assistant': ['get:actors', 'get:movies'],
+    'director': ['add:actor', 'delete:actor', 'get:actors', 'get:movies',
+                 'modify:actor'],
+    'producer': ['add:actor', 'add:movie', 'delete:actor', 'delete:movie',
+                 'get:actors', 'get:movies', 'modify:actor', 'modify:movie'],
+}
+
+
+def b64_uint(value):
+    data = value.to_bytes((value.bit_length() + 7) // 8, 'big')
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode()
+
+
+def public_jwk(key, kid):
+    '''
+    the public part of an RSA key as a JWKS entry
+    '''
+    return {'kty': 'RSA', 'kid': kid, 'use': 'sig', 'alg': 'RS256',
+            'n': b64_uint(key.n), 'e': b64_uint(key.e)}
+
+
+def jwks():
+    return {'keys': [public_jwk(SIGNING_KEY, KID)]}
+
+
+def public_pem():
+    return SIGNING_KEY.publickey().exportKey().decode()
+
+
+def mint_token(permissions, lifetime=3600, subject='local|user'):
+    '''
+    return an Authorization header value for a token granting permissions,
+    issued for AUTH0_DOMAIN and API_AUDIENCE
+    '''
+    now = int(time.time())
+    claims = {
+        'iss': 'https://' + os.environ['AUTH0_DOMAIN'] + '/',
+        'aud': os.environ['API_AUDIENCE'],
+        'sub': subject,
+        'iat': now,
+        'exp': now + lifetime,
+        'permissions': list(permissions),
+    }
+    return 'Bearer ' + jwt.encode(claims, PRIVATE_PEM, algorithm='RS256',
+                                  headers={'kid': KID})